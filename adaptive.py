@@ -0,0 +1,326 @@
+import math
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from archive import new_archive_files, read_archived_answers
+from exam_session import OPTIONS, ExamSession
+
+# Width of a difficulty bucket, in logits
+BUCKET_WIDTH = 0.25
+
+MIN_QUESTIONS = 5
+MAX_QUESTIONS = 15
+# Stop once the ability estimate is this precise; a 10 question random paper gets to about 0.6
+TARGET_STANDARD_ERROR = 0.6
+
+
+def probability_correct(ability, difficulty):
+    # Rasch model: both on the same logit scale
+    return 1 / (1 + math.exp(difficulty - ability))
+
+
+def estimate_ability(difficulties, responses, prior_sd=1.0):
+    """MAP ability estimate (N(0, prior_sd) prior) and its standard error, by Newton's method."""
+    ability = 0.0
+    information = 1 / prior_sd ** 2
+    for _ in range(25):
+        gradient = -ability / prior_sd ** 2
+        information = 1 / prior_sd ** 2
+        for difficulty, correct in zip(difficulties, responses):
+            p = probability_correct(ability, difficulty)
+            gradient += correct - p
+            information += p * (1 - p)
+        step = max(-1.0, min(1.0, gradient / information))
+        ability += step
+        if abs(step) < 1e-4:
+            break
+    return ability, 1 / math.sqrt(information)
+
+
+class ItemBank:
+    """Question difficulties from UserAnswers, bucketed per question_type for O(log n) picks.
+
+    A question's difficulty is the logit of its smoothed failure rate,
+    log((wrong + 1) / (right + 1)), so unanswered questions sit at 0 and
+    the scale matches the Rasch ability estimate. Questions live in
+    BUCKET_WIDTH wide buckets; each type keeps a sorted list of bucket keys,
+    so finding questions near a given ability is a bisect followed by a
+    random draw from the nearest non-empty bucket. refresh() reads only the
+    answers saved since the last refresh and moves the questions whose
+    bucket changed.
+    """
+
+    def __init__(self, db, min_refresh_interval=10.0):
+        self.db = db
+        self.min_refresh_interval = min_refresh_interval
+        self._lock = threading.Lock()
+        self._refreshed_at = None
+        self._reset()
+
+    def _reset(self):
+        self._generation = self.db.question_index.generation
+        self._epoch = self.db.epoch()
+        # Per shard; only answers after these (and archive files after these) are read by refresh()
+        self.last_answer_ids = {}
+        self.last_archive_ids = {}
+        self._last_question_id = 0
+        self.exam_types = []
+        # Indexed by question_id
+        self._type = array("b")
+        self._attempts = array("l")
+        self._correct = array("l")
+        self._bucket = array("l")
+        self._position = array("l")
+        # Per type code: bucket key -> question ids, and the sorted keys
+        self._buckets = []
+        self._keys = []
+
+    def refresh(self, force=False):
+        """Picks up new questions and answers; returns the number of new answers."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._refreshed_at is not None and now - self._refreshed_at < self.min_refresh_interval:
+                return 0
+            self._refreshed_at = now
+            # Questions were re-imported or edited, or answers moved between shards: start over
+            if self.db.question_index.generation != self._generation or self.db.epoch() != self._epoch:
+                self._reset()
+
+            conn = self.db._get_connection()
+            try:
+                self._load_questions(conn)
+            finally:
+                self.db._release_connection(conn)
+
+            new_answers = 0
+            for shard in self.db.shards():
+                conn = shard._get_connection()
+                try:
+                    # One snapshot, so answers being archived are seen exactly once
+                    conn.execute("BEGIN")
+                    if shard.db_name not in self.last_answer_ids:
+                        new_answers += self._load_totals(shard, conn)
+                        conn.commit()
+                        continue
+                    last_answer_id = self.last_answer_ids[shard.db_name]
+                    files = new_archive_files(conn, self.last_archive_ids[shard.db_name])
+                    rows = [(answer_id, question_id, is_correct) for answer_id, _, question_id, is_correct
+                            in read_archived_answers(shard.db_name, files, last_answer_id)]
+                    rows += conn.execute(
+                        "SELECT answer_id, question_id, is_correct FROM UserAnswers WHERE answer_id > ? ORDER BY answer_id",
+                        (last_answer_id,)
+                    ).fetchall()
+                    conn.commit()
+                finally:
+                    shard._release_connection(conn)
+
+                if files:
+                    self.last_archive_ids[shard.db_name] = files[-1][0]
+                for answer_id, question_id, is_correct in rows:
+                    self.last_answer_ids[shard.db_name] = max(self.last_answer_ids[shard.db_name], answer_id)
+                    if not question_id or question_id >= len(self._type) or self._type[question_id] < 0:
+                        continue
+                    self._attempts[question_id] += 1
+                    self._correct[question_id] += bool(is_correct)
+                    self._place(question_id)
+                new_answers += len(rows)
+            return new_answers
+
+    def _load_questions(self, conn):
+        rows = conn.execute(
+            "SELECT question_id, question_type FROM Questions WHERE question_id > ? ORDER BY question_id",
+            (self._last_question_id,)
+        ).fetchall()
+        if not rows:
+            return
+        self._grow(rows[-1][0] + 1)
+        codes = {exam_type: code for code, exam_type in enumerate(self.exam_types)}
+        for question_id, question_type in rows:
+            code = codes.get(question_type)
+            if code is None:
+                code = codes[question_type] = len(self.exam_types)
+                self.exam_types.append(question_type)
+                self._buckets.append({})
+                self._keys.append([])
+            self._type[question_id] = code
+            self._place(question_id)
+        self._last_question_id = rows[-1][0]
+
+    def _load_totals(self, shard, conn):
+        # First load of a shard: per-question totals in one pass over the (question_id, is_correct)
+        # index, plus the totals kept for archived answers
+        last_answer_id = conn.execute("SELECT IFNULL(MAX(answer_id), 0) FROM UserAnswers").fetchone()[0]
+        rows = conn.execute(
+            "SELECT question_id, COUNT(*), TOTAL(is_correct) FROM UserAnswers "
+            "WHERE question_id IS NOT NULL AND answer_id <= ? GROUP BY question_id",
+            (last_answer_id,)
+        ).fetchall()
+        rows += conn.execute(
+            "SELECT question_id, attempts, correct FROM QuestionAnswerSummary"
+        ).fetchall()
+        self.last_archive_ids[shard.db_name] = conn.execute(
+            "SELECT IFNULL(MAX(file_id), 0) FROM AnswerArchive").fetchone()[0]
+        for question_id, attempts, correct in rows:
+            if question_id < len(self._type) and self._type[question_id] >= 0:
+                self._attempts[question_id] += attempts
+                self._correct[question_id] += int(correct)
+                self._place(question_id)
+        self.last_answer_ids[shard.db_name] = last_answer_id
+        return sum(row[1] for row in rows)
+
+    def _grow(self, size):
+        missing = size - len(self._type)
+        if missing > 0:
+            self._type.extend([-1] * missing)
+            self._attempts.extend([0] * missing)
+            self._correct.extend([0] * missing)
+            self._bucket.extend([0] * missing)
+            self._position.extend([-1] * missing)
+
+    def _place(self, question_id):
+        # Put the question in the bucket for its current difficulty, moving it if needed
+        key = math.floor(self.difficulty(question_id) / BUCKET_WIDTH)
+        position = self._position[question_id]
+        if position >= 0 and self._bucket[question_id] == key:
+            return
+        buckets = self._buckets[self._type[question_id]]
+        if position >= 0:
+            ids = buckets[self._bucket[question_id]]
+            last = ids.pop()
+            if last != question_id:
+                ids[position] = last
+                self._position[last] = position
+        ids = buckets.get(key)
+        if ids is None:
+            ids = buckets[key] = array("q")
+            insort(self._keys[self._type[question_id]], key)
+        self._bucket[question_id] = key
+        self._position[question_id] = len(ids)
+        ids.append(question_id)
+
+    def difficulty(self, question_id):
+        if question_id >= len(self._type):
+            return 0.0
+        attempts = self._attempts[question_id]
+        correct = self._correct[question_id]
+        return math.log((attempts - correct + 1) / (correct + 1))
+
+    def pick(self, exam_type, ability, exclude=()):
+        """A question of exam_type close to `ability` in difficulty, not in `exclude`; None if none left."""
+        with self._lock:
+            code = self.exam_types.index(exam_type) if exam_type in self.exam_types else None
+            if code is None:
+                return None
+            buckets = self._buckets[code]
+            keys = self._keys[code]
+            target = ability / BUCKET_WIDTH
+            # Walk outwards from the bucket nearest the target
+            right = bisect_left(keys, math.floor(target))
+            left = right - 1
+            while left >= 0 or right < len(keys):
+                if right >= len(keys) or (left >= 0 and target - (keys[left] + 1) < keys[right] - target):
+                    ids, left = buckets[keys[left]], left - 1
+                else:
+                    ids, right = buckets[keys[right]], right + 1
+                question_id = _draw(ids, exclude)
+                if question_id is not None:
+                    return question_id
+            return None
+
+    def expected_score(self, exam_type, ability):
+        """Expected % correct over every question of exam_type, for a student of this ability."""
+        with self._lock:
+            if exam_type not in self.exam_types:
+                return 0.0
+            buckets = self._buckets[self.exam_types.index(exam_type)]
+            total = sum(len(ids) for ids in buckets.values())
+            expected = sum(len(ids) * probability_correct(ability, (key + 0.5) * BUCKET_WIDTH)
+                           for key, ids in buckets.items())
+            return expected / total * 100 if total else 0.0
+
+    def extend(self, exam, exclude=()):
+        """Adds the best next question to an adaptive exam if it should go on; returns whether it did."""
+        if not exam.needs_more():
+            return False
+        exclude = set(exclude)
+        exclude.update(exam.question_ids)
+        question_id = self.pick(exam.exam_type, exam.ability, exclude)
+        if question_id is None:
+            return False
+        exam.add_question(question_id)
+        return True
+
+
+def _draw(ids, exclude, attempts=8):
+    # Random so equally difficult questions share the exposure
+    if not ids:
+        return None
+    for _ in range(attempts):
+        question_id = ids[random.randrange(len(ids))]
+        if question_id not in exclude:
+            return question_id
+    candidates = [question_id for question_id in ids if question_id not in exclude]
+    return random.choice(candidates) if candidates else None
+
+
+class AdaptiveExamSession(ExamSession):
+    """An exam whose next question is chosen from the answers so far.
+
+    Holds the difficulty each question had when it was asked and the current
+    ability estimate; ItemBank.extend() appends the next question, until the
+    estimate is precise enough or MAX_QUESTIONS is reached.
+    """
+
+    __slots__ = ("difficulties", "ability", "standard_error")
+
+    def __init__(self, exam_type, question_ids=(), session_id=None):
+        super().__init__(exam_type, question_ids, session_id)
+        self.difficulties = array("d")
+        self.ability = 0.0
+        self.standard_error = 1.0
+
+    @classmethod
+    def resume(cls, session_id, exam_type, answers, bank):
+        """Rebuilds a session from its answers (in the order given) and picks the next question."""
+        session = cls(exam_type, [question_id for question_id, _, _ in answers], session_id)
+        for i, (question_id, selected, is_correct) in enumerate(answers):
+            session.selected[i] = OPTIONS.index(selected)
+            session.correct[i] = bool(is_correct)
+            session.difficulties.append(bank.difficulty(question_id))
+        session.answered = len(answers)
+        if answers:
+            session.ability, session.standard_error = estimate_ability(session.difficulties, session.correct)
+        bank.extend(session)
+        return session
+
+    def add_question(self, question_id):
+        self.question_ids.append(question_id)
+        self.selected.append(0)
+        self.correct.append(0)
+
+    def answer(self, option, correct_answer, difficulty=0.0):
+        is_correct = super().answer(option, correct_answer)
+        self.difficulties.append(difficulty)
+        self.ability, self.standard_error = estimate_ability(self.difficulties, self.correct[:self.answered])
+        return is_correct
+
+    def needs_more(self):
+        if self.answered >= MAX_QUESTIONS:
+            return False
+        return self.answered < MIN_QUESTIONS or self.standard_error > TARGET_STANDARD_ERROR
+
+
+_item_banks = {}
+_item_banks_lock = threading.Lock()
+
+
+def get_item_bank(db, **kwargs):
+    # Shared by every session in this process; loaded on first use
+    with _item_banks_lock:
+        bank = _item_banks.get(db.db_name)
+        if bank is None:
+            bank = _item_banks[db.db_name] = ItemBank(db, **kwargs)
+        return bank
@@ -0,0 +1,242 @@
+import threading
+import time
+from itertools import chain, islice
+
+import numpy as np
+import pandas as pd
+
+from archive import new_archive_files, read_archived_answers
+
+
+class AnswerAnalytics:
+    """Columnar, incrementally refreshed view of UserAnswers for the admin dashboard.
+
+    Answers are pulled in chunks into NumPy arrays (user, question, correct),
+    starting after the last answer_id already loaded from each shard, so a
+    refresh only reads what was written since. Answers moved to archive
+    files by `manage.py archive` are read from there. Metrics are computed
+    with vectorized bincounts and cached until new answers arrive.
+    """
+
+    def __init__(self, db, chunk_size=200_000, min_refresh_interval=30.0):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.min_refresh_interval = min_refresh_interval
+
+        self._reset_answers()
+
+        # question_id -> index into self.exam_types (-1 if unknown)
+        self.exam_types = []
+        self._question_type = np.empty(0, dtype=np.int16)
+        self._last_question_id = 0
+
+        self._lock = threading.Lock()
+        self._refreshed_at = None
+        self._results = {}
+
+    def _reset_answers(self):
+        # Answer ids are per shard, and change when a tenant moves to another shard
+        self._epoch = self.db.epoch()
+        self.last_answer_ids = {}
+        self.last_archive_ids = {}
+        self._users = np.empty(0, dtype=np.int32)
+        self._questions = np.empty(0, dtype=np.int32)
+        self._correct = np.empty(0, dtype=np.bool_)
+        self._results = {}
+
+    def refresh(self, force=False):
+        """Loads answers newer than those already loaded; returns the number of new answers."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._refreshed_at is not None and now - self._refreshed_at < self.min_refresh_interval:
+                return 0
+            self._refreshed_at = now
+
+            conn = self.db._get_connection()
+            try:
+                self._load_question_types(conn)
+            finally:
+                self.db._release_connection(conn)
+            if self.db.epoch() != self._epoch:
+                self._reset_answers()
+
+            users, questions, correct = [], [], []
+            for shard in self.db.shards():
+                last_answer_id = self.last_answer_ids.get(shard.db_name, 0)
+                conn = shard._get_connection()
+                try:
+                    # One snapshot for both reads, so an archiving run can't make answers
+                    # disappear from one or show up in both
+                    conn.execute("BEGIN")
+                    files = new_archive_files(conn, self.last_archive_ids.get(shard.db_name, 0))
+                    cursor = conn.execute(
+                        "SELECT answer_id, IFNULL(user_id, 0), IFNULL(question_id, 0), is_correct "
+                        "FROM UserAnswers WHERE answer_id > ? ORDER BY answer_id",
+                        (last_answer_id,),
+                    )
+                    archived = read_archived_answers(shard.db_name, files, last_answer_id)
+                    for rows in chain(_chunks(archived, self.chunk_size), _chunks(cursor, self.chunk_size)):
+                        block = np.array(rows, dtype=np.int64)
+                        users.append(block[:, 1].astype(np.int32))
+                        questions.append(block[:, 2].astype(np.int32))
+                        correct.append(block[:, 3] != 0)
+                        last_answer_id = max(last_answer_id, int(block[:, 0].max()))
+                    conn.commit()
+                finally:
+                    shard._release_connection(conn)
+                self.last_answer_ids[shard.db_name] = last_answer_id
+                if files:
+                    self.last_archive_ids[shard.db_name] = files[-1][0]
+
+            if not users:
+                return 0
+            self._users = np.concatenate([self._users] + users)
+            self._questions = np.concatenate([self._questions] + questions)
+            self._correct = np.concatenate([self._correct] + correct)
+            self._results = {}
+            return sum(len(block) for block in users)
+
+    def _load_question_types(self, conn):
+        rows = conn.execute(
+            "SELECT question_id, question_type FROM Questions WHERE question_id > ? ORDER BY question_id",
+            (self._last_question_id,),
+        ).fetchall()
+        if not rows:
+            return
+        codes = {exam_type: code for code, exam_type in enumerate(self.exam_types)}
+        question_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        type_codes = np.fromiter((codes.setdefault(row[1], len(codes)) for row in rows), dtype=np.int16, count=len(rows))
+        self.exam_types = list(codes)
+
+        size = int(question_ids[-1]) + 1
+        if size > len(self._question_type):
+            grown = np.full(size, -1, dtype=np.int16)
+            grown[:len(self._question_type)] = self._question_type
+            self._question_type = grown
+        self._question_type[question_ids] = type_codes
+        self._last_question_id = int(question_ids[-1])
+
+    def _type_codes(self):
+        # question_id -> type code, covering every question id seen in answers
+        size = int(self._questions.max()) + 1 if len(self._questions) else 0
+        type_codes = np.full(max(size, len(self._question_type)), -1, dtype=np.int16)
+        type_codes[:len(self._question_type)] = self._question_type
+        return type_codes
+
+    def _cached(self, name, compute):
+        with self._lock:
+            if name not in self._results:
+                self._results[name] = compute()
+            return self._results[name]
+
+    def _user_scores(self):
+        # Per-user attempts/correct, indexed by user_id
+        size = int(self._users.max()) + 1 if len(self._users) else 0
+        attempts = np.bincount(self._users, minlength=size)
+        correct = np.bincount(self._users, weights=self._correct, minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            score = np.where(attempts > 0, correct / attempts, np.nan)
+        return attempts, correct, score
+
+    def question_stats(self):
+        """Per-question attempts, difficulty (p-value) and discrimination index."""
+        def compute():
+            size = max(int(self._questions.max()) + 1 if len(self._questions) else 0, len(self._question_type))
+            attempts = np.bincount(self._questions, minlength=size)
+            correct = np.bincount(self._questions, weights=self._correct, minlength=size)
+
+            # Discrimination: p-value among the top 27% of students minus the bottom 27%
+            _, _, user_score = self._user_scores()
+            answer_score = user_score[self._users]
+            discrimination = np.full(size, np.nan)
+            if len(answer_score):
+                low, high = np.nanpercentile(user_score, [27, 73])
+                upper = answer_score >= high
+                lower = answer_score <= low
+                upper_attempts = np.bincount(self._questions[upper], minlength=size)
+                lower_attempts = np.bincount(self._questions[lower], minlength=size)
+                upper_correct = np.bincount(self._questions[upper], weights=self._correct[upper], minlength=size)
+                lower_correct = np.bincount(self._questions[lower], weights=self._correct[lower], minlength=size)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    discrimination = upper_correct / upper_attempts - lower_correct / lower_attempts
+
+            answered = np.flatnonzero(attempts)
+            type_codes = self._type_codes()
+            exam_types = np.array(self.exam_types + ["UNKNOWN"], dtype=object)
+            return pd.DataFrame({
+                "Question ID": answered,
+                "Exam Type": exam_types[type_codes[answered]],
+                "Attempts": attempts[answered],
+                "Correct": correct[answered].astype(np.int64),
+                "Difficulty (p-value)": correct[answered] / attempts[answered],
+                "Discrimination": discrimination[answered],
+            })
+        return self._cached("question_stats", compute)
+
+    def type_score_distribution(self, bins=10):
+        """Per exam type: summary percentiles of per-student accuracy and a histogram."""
+        def compute():
+            answer_type = self._type_codes()[self._questions].astype(np.int64)
+            known = answer_type >= 0
+
+            num_types = max(len(self.exam_types), 1)
+            # One bucket per (user, type) pair
+            key = self._users[known].astype(np.int64) * num_types + answer_type[known]
+            size = (int(self._users.max()) + 1) * num_types if len(self._users) else 0
+            attempts = np.bincount(key, minlength=size).reshape(-1, num_types)
+            correct = np.bincount(key, weights=self._correct[known], minlength=size).reshape(-1, num_types)
+
+            summary = []
+            histograms = {}
+            for code, exam_type in enumerate(self.exam_types):
+                taken = attempts[:, code] > 0
+                scores = correct[taken, code] / attempts[taken, code] * 100
+                if not len(scores):
+                    continue
+                p10, p25, p50, p75, p90 = np.percentile(scores, [10, 25, 50, 75, 90])
+                summary.append((exam_type.strip(), len(scores), scores.mean(), p10, p25, p50, p75, p90))
+                histograms[exam_type.strip()] = np.histogram(scores, bins=bins, range=(0, 100))[0]
+            columns = ["Exam Type", "Students", "Mean %", "P10", "P25", "Median", "P75", "P90"]
+            return pd.DataFrame(summary, columns=columns), pd.DataFrame(histograms, index=[
+                f"{int(edge)}-{int(edge + 100 / bins)}%" for edge in np.arange(0, 100, 100 / bins)
+            ])
+        return self._cached("type_score_distribution", compute)
+
+    def cohort_percentiles(self, percentiles=(10, 25, 50, 75, 90)):
+        """Overall accuracy at the given cohort percentiles, plus each student's percentile rank."""
+        def compute():
+            attempts, correct, score = self._user_scores()
+            active = np.flatnonzero(attempts)
+            scores = score[active] * 100
+            cutoffs = pd.Series(np.percentile(scores, percentiles) if len(scores) else np.nan,
+                                index=[f"P{p}" for p in percentiles])
+            ranks = pd.DataFrame({
+                "User ID": active,
+                "Attempts": attempts[active],
+                "Score %": scores,
+                "Percentile": pd.Series(scores).rank(pct=True).to_numpy() * 100,
+            })
+            return cutoffs, ranks
+        return self._cached("cohort_percentiles", compute)
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+_analytics = {}
+_analytics_lock = threading.Lock()
+
+
+def get_analytics(db, **kwargs):
+    # Shared by every admin session in this process, so answers are loaded once
+    with _analytics_lock:
+        analytics = _analytics.get(db.db_name)
+        if analytics is None:
+            analytics = _analytics[db.db_name] = AnswerAnalytics(db, **kwargs)
+        return analytics
@@ -1,12 +1,51 @@
+import os
+import sqlite3
+import threading
 import streamlit as st
-from streamlit_option_menu import option_menu
-from utilities import UserDatabase
-import pandas as pd
-
-# Initialize the UserDatabase instance
-db = UserDatabase()
-
-exam_questions_storage = {}
+import instrumentation
+from utilities import EXAM_TYPES, UserDatabase
+from exam_session import OPTIONS, ExamSession
+from adaptive import MAX_QUESTIONS, AdaptiveExamSession, get_item_bank
+from async_database import AsyncUserDatabase, run_all
+from sharding import ShardedUserDatabase
+from paper_pool import get_paper_pool
+# pandas, analytics (numpy/pandas) and the option menu are imported in the pages that use
+# them, so a fresh server process can serve the login page without loading them
+
+# Initialize the UserDatabase instance (answers are saved one by one as they are submitted).
+# With MOCKEXAM_CATALOG set, users and answers are spread over per-tenant shard files instead.
+db = ShardedUserDatabase(os.environ["MOCKEXAM_CATALOG"]) if os.environ.get("MOCKEXAM_CATALOG") else UserDatabase()
+
+# Same database, for pages that issue independent lookups concurrently
+adb = AsyncUserDatabase(db)
+
+# Pre-sampled exam papers, shared by every session in this server process
+papers = get_paper_pool(db)
+
+# Metrics endpoint/file, profiler and log level, as configured by the environment (once per process)
+instrumentation.start_from_env()
+instrumentation.register_collector("mockexam_pool", db.pool_stats)
+instrumentation.register_collector("mockexam_cache", db.cache_stats)
+instrumentation.register_collector("mockexam_papers", papers.stats)
+
+@st.cache_resource(show_spinner=False)
+def warm_up():
+    # Once per server process, in the background: connections, question index, hashing workers
+    thread = threading.Thread(target=db.warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+@st.cache_resource(show_spinner=False)
+def load_logo():
+    # Read once per process instead of on every render
+    with open("logo.png", "rb") as f:
+        return f.read()
+
+def current_user_id():
+    # Looked up once per session instead of on every save/progress render
+    if "user_id" not in st.session_state:
+        st.session_state["user_id"] = db.get_user_id(st.session_state["username"])
+    return st.session_state["user_id"]
 
 # Login/Signup Flow with Graceful UI
 def login_signup():
@@ -35,11 +74,7 @@ def login_signup():
 
         if st.button("Signup"):
             # Check if the username or email already exists in the database
-            conn = db._get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM Users WHERE username = ? OR email = ?", (username, email))
-            user = cursor.fetchone()
-            conn.close()
+            user = db.find_user(username, email)
 
             if user:
                 if user[1] == username:
@@ -93,22 +128,41 @@ def admin_dashboard():
         st.stop()
 
     st.subheader("Manage Users")
-    users = db.get_all_users()
+
+    # Only the current page of users is loaded and rendered. The user count, the page
+    # and the analytics refresh don't depend on each other, so they run together.
+    page_size = 50
+    import pandas as pd
+    from analytics import get_analytics
+
+    page = st.session_state.get("users_page", 1) - 1
+    analytics = get_analytics(db)
+    total_users, users, _ = run_all(
+        adb.count_users(), adb.get_users_page(page, page_size), adb.run(analytics.refresh)
+    )
+    pages = max(1, -(-total_users // page_size))
+    if page >= pages:
+        page = pages - 1
+        st.session_state["users_page"] = pages
+        users = db.get_users_page(page, page_size)
+    st.number_input("Page", min_value=1, max_value=pages, value=1, step=1, key="users_page")
 
     columns = ["User ID", "Username", "Email", "User Type", "Is Admin", 
                "Total Questions Attempted", "Total Correct Answers", "Total Score"]
     users_df = pd.DataFrame(users, columns=columns)
 
     # Ensure "Is Admin" is a Boolean column
-    users_df["Is Admin"] = users_df["Is Admin"].map(lambda x: x == "Yes")
+    users_df["Is Admin"] = users_df["User Type"].eq("admin")
 
     # Display the table
+    st.caption(f"{total_users} users, page {page + 1} of {pages}")
     st.dataframe(users_df)
 
-    # Dropdown for appointing new admin
+    exam_insights()
+
+    # Dropdown for appointing or removing admins (users on the current page)
     st.subheader("Appoint New Admin")
-    non_admin_users = users_df[~users_df["Is Admin"]]  # Filter non-admins
-    user_options = non_admin_users["Username"].tolist()
+    user_options = users_df["Username"].tolist()
 
     user_to_promote = st.selectbox("Select a user to appoint as admin:", user_options)
 
@@ -129,6 +183,32 @@ def admin_dashboard():
                 st.error(e)
         
 
+def exam_insights():
+    from analytics import get_analytics
+
+    st.subheader("Exam Insights")
+    analytics = get_analytics(db)  # Refreshed by admin_dashboard
+
+    summary, histogram = analytics.type_score_distribution()
+    cutoffs, _ = analytics.cohort_percentiles()
+    question_stats = analytics.question_stats()
+
+    if question_stats.empty:
+        st.info("No answers recorded yet.")
+        return
+
+    by_type, by_question, cohort = st.tabs(["Exam Types", "Questions", "Cohort"])
+    with by_type:
+        st.dataframe(summary.round(1), hide_index=True)
+        st.bar_chart(histogram)
+    with by_question:
+        st.caption("Hardest questions first. Discrimination is the p-value gap between the top and bottom 27% of students.")
+        hardest = question_stats.sort_values("Difficulty (p-value)").head(50)
+        st.dataframe(hardest.round(2), hide_index=True)
+    with cohort:
+        st.dataframe(cutoffs.round(1).to_frame("Score %"))
+
+
 def exams():
     if "username" not in st.session_state:
         st.error("Please log in to take the mock exam.")
@@ -138,21 +218,52 @@ def exams():
         st.error("Admins cannot take exams.")
         return
 
-    st.subheader("Select an Exam Type")
-    exam_types = ["VERBAL ABILITY", " ANALYTICAL REASONING", "QUANTITATIVE REASONING", "SUBJECT KNOWLEDGE"]
+    # An exam left unfinished by a restart or a dropped connection can be picked up again
+    active = db.get_active_exam_session(current_user_id())
+    if active:
+        session_id, exam_type, question_ids, answers, adaptive = active
+        answered = f"{len(answers)} answered" if adaptive else f"{len(answers)}/{len(question_ids)} answered"
+        st.info(f"You have an unfinished {exam_type.strip()} exam ({answered}).")
+        if st.button("Resume Exam"):
+            if adaptive:
+                bank = get_item_bank(db)
+                bank.refresh()
+                st.session_state["exam"] = AdaptiveExamSession.resume(session_id, exam_type, answers, bank)
+            else:
+                st.session_state["exam"] = ExamSession.resume(session_id, exam_type, question_ids, answers)
+            st.session_state["page"] = "take_exam"
+            st.rerun()
 
-    for exam in exam_types:
+    st.subheader("Select an Exam Type")
+    adaptive = st.checkbox("Adaptive exam", help="Each question is picked to match your answers so far, "
+                           "and the exam ends as soon as your level is clear.")
+    for exam in EXAM_TYPES:
         if st.button(exam):
-            questions = db.get_random_questions(exam)
-            if not questions:
+            # Avoid repeating questions already served earlier in this session
+            served = st.session_state.setdefault("served_question_ids", set())
+            # ...and, where the bank allows, ones answered in earlier exams; wrong answers come back for review
+            seen, review = db.get_question_history(current_user_id(), exam)
+            if adaptive:
+                bank = get_item_bank(db)
+                bank.refresh()  # Only reads answers saved since the last refresh
+                exam_session = AdaptiveExamSession(exam)
+                bank.extend(exam_session, served)
+            else:
+                # Only ids and compact answer buffers live in session state; rows come from the shared cache
+                exam_session = ExamSession(exam, papers.take(exam, exclude=served, seen=seen, review=review))
+            question_ids = list(exam_session.question_ids)
+            if not question_ids:
                 st.error(f"No questions available for {exam}. Please try another exam type.")
                 return
+            served.update(question_ids)
 
-            # Store exam data in session state
-            st.session_state["exam_questions_storage"] = {exam: questions}
-            st.session_state["current_question_index"] = 0
-            st.session_state["user_answers"] = []
-            st.session_state["exam_type"] = exam
+            try:
+                exam_session.session_id = db.start_exam_session(current_user_id(), exam, question_ids, adaptive)
+            except (ValueError, sqlite3.OperationalError) as e:
+                # e.g. the student's data is being moved to another shard
+                st.error(str(e))
+                return
+            st.session_state["exam"] = exam_session
             st.session_state["page"] = "take_exam"
             st.rerun()
             break
@@ -162,51 +273,76 @@ def save_exam_results_frontend():
         st.error("You need to log in to save exam results.")
         return
 
-    user_id = db.get_user_id(st.session_state["username"])
-    user_answers = st.session_state.get("user_answers", [])
+    exam = st.session_state["exam"]
 
     try:
-        db.save_exam_results_backend(user_id, user_answers)
-        total_correct = sum(1 for _, _, is_correct in user_answers if is_correct)
-        total_attempted = len(user_answers)
+        # Answers are already saved; this records the attempt, once
+        if not exam.saved:
+            db.finish_exam_session(exam.session_id)
+            exam.saved = True
+        total_correct = exam.total_correct()
+        total_attempted = exam.answered
         st.write(f"**Your Results:**")
         st.write(f"Total Questions: {total_attempted}")
         st.write(f"Correct Answers: {total_correct}")
         st.write(f"Your Score: {int((total_correct / total_attempted) * 100) if total_attempted > 0 else 0}%")
+        if isinstance(exam, AdaptiveExamSession):
+            # Adaptive questions are pitched at the student's level, so the raw score hovers around 50%
+            expected = get_item_bank(db).expected_score(exam.exam_type, exam.ability)
+            st.write(f"Estimated score on a typical {exam.exam_type.strip()} exam: {expected:.0f}%")
         st.button("Go Back to Exams", on_click=lambda: st.session_state.update({"page": "exams"}))
     except Exception as e:
         st.error(f"An error occurred while saving results: {e}")
 
 def take_exam():
-    exam_type = st.session_state.get("exam_type")
-    questions = st.session_state.get("exam_questions_storage", {}).get(exam_type, [])
+    exam = st.session_state.get("exam")
 
-    if not questions:
+    if not exam:
         st.error("No questions found for the selected exam type.")
         st.button("Go Back to Exams", on_click=lambda: st.session_state.update({"page": "exams"}))
         return
 
-    current_index = st.session_state.get("current_question_index", 0)
-    if current_index < len(questions):
-        question = questions[current_index]
-        st.subheader(f"Question {current_index + 1}/{len(questions)}")
+    current_index = exam.answered
+    if not exam.finished:
+        question = papers.hydrate([exam.current_question_id()])[0]
+        if isinstance(exam, AdaptiveExamSession):
+            st.subheader(f"Question {current_index + 1} (at most {MAX_QUESTIONS})")
+        else:
+            st.subheader(f"Question {current_index + 1}/{len(exam)}")
         st.write(question[1])  # Question text
 
         # Display options A, B, C, D with corresponding content
-        options = ["A", "B", "C", "D"]
         option_content = question[2:6]  # Assuming the options are stored in this part of the question tuple
         
-        selected_option = st.radio("Choose an option:", options, format_func=lambda option: f"{option}: {option_content[options.index(option)]}", key=f"question_{current_index}")
+        selected_option = st.radio("Choose an option:", OPTIONS, format_func=lambda option: f"{option}: {option_content[OPTIONS.index(option)]}", key=f"question_{current_index}")
 
         if st.button("Submit Answer"):
             is_correct = selected_option == question[6]  # Assuming the correct answer is stored in the 7th position
-            st.session_state["user_answers"].append((question[0], selected_option, is_correct))
-            st.session_state["current_question_index"] += 1
+            try:
+                db.record_answer(exam.session_id, current_user_id(), question[0], selected_option, is_correct)
+            except (ValueError, sqlite3.OperationalError) as e:
+                # The student's data is being (or was, while this exam was open) moved to another shard
+                st.error(str(e))
+                st.session_state.pop("exam", None)
+                st.button("Go Back to Exams", on_click=lambda: st.session_state.update({"page": "exams"}))
+                return
+            if isinstance(exam, AdaptiveExamSession):
+                # Next question from the in-memory difficulty index, no query needed
+                bank = get_item_bank(db)
+                exam.answer(selected_option, question[6], bank.difficulty(question[0]))
+                served = st.session_state.setdefault("served_question_ids", set())
+                if bank.extend(exam, served):
+                    served.add(exam.question_ids[-1])
+            else:
+                exam.answer(selected_option, question[6])
             st.rerun()
     else:
         save_exam_results_frontend()
 
 
+TREND_ATTEMPTS = 50
+HISTORY_PAGE_SIZE = 10
+
 def progress():
     st.title("User Progress")
 
@@ -214,12 +350,18 @@ def progress():
         st.error("Please log in to view your progress.")
         st.stop()
 
-    user_id = db.get_user_id(st.session_state["username"])
+    import pandas as pd
+
+    user_id = current_user_id()
 
-    conn = db._get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT username, email, user_type FROM Users WHERE user_id = ?", (user_id,))
-    user_details = cursor.fetchone()
+    # History pages are keyed on the last row shown (see get_exam_history); the stack
+    # holds the key each page was loaded from so "Newer" can go back
+    cursors = st.session_state.setdefault("history_cursors", [None])
+    user_details, (total_attempted, total_correct, total_score), trend, topics, history = run_all(
+        adb.get_user_details(user_id), adb.get_user_progress(user_id),
+        adb.get_exam_history(user_id, limit=TREND_ATTEMPTS), adb.get_topic_stats(user_id),
+        adb.get_exam_history(user_id, before=cursors[-1], limit=HISTORY_PAGE_SIZE)
+    )
 
     if user_details:
         username, email, user_type = user_details
@@ -230,8 +372,6 @@ def progress():
     # Create a column layout for displaying progress metrics
     col1, col2, col3 = st.columns(3)
     
-    total_attempted, total_correct, total_score = db.get_user_progress(user_id)
-    
     if total_attempted > 0:
         with col1:
             st.metric("Total Questions Attempted", total_attempted)
@@ -241,7 +381,32 @@ def progress():
             st.metric("Success Percentage", total_score,"%")
     else:
         st.warning("No progress data available.")
-    
+
+    history_columns = ["Attempt", "Completed", "Exam", "Questions", "Correct", "Score"]
+    if trend:
+        st.subheader("Score Trend")
+        st.caption(f"Your last {len(trend)} exams")
+        trend_df = pd.DataFrame(trend[::-1], columns=history_columns).fillna({"Exam": "Other"})
+        st.line_chart(trend_df.pivot_table(index="Completed", columns="Exam", values="Score"))
+
+    if topics:
+        st.subheader("Weak Topics")
+        topics_df = pd.DataFrame(topics, columns=["Topic", "Questions", "Correct", "Accuracy %"])
+        weakest = topics_df.iloc[0]
+        st.caption(f"Practise {weakest['Topic'].strip()} next: {weakest['Accuracy %']:.0f}% correct so far.")
+        st.bar_chart(topics_df.set_index("Topic")["Accuracy %"])
+
+    if history:
+        st.subheader("Exam History")
+        st.dataframe(pd.DataFrame(history, columns=history_columns).drop(columns="Attempt"), hide_index=True)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.button("Newer", disabled=len(cursors) == 1, on_click=cursors.pop)
+        with col2:
+            last = history[-1]
+            st.button("Older", disabled=len(history) < HISTORY_PAGE_SIZE,
+                      on_click=lambda: cursors.append((last[1], last[0])))
+
     # Display additional details in an expander
     with st.expander("More Details"):
         st.write("**Detailed Statistics**")
@@ -265,7 +430,7 @@ def display_sidebar():
     # Create a sidebar layout
     with st.sidebar:
         # Display the logo with a large size
-        st.image("logo.png", width=200)  # Adjust width to make the logo larger or smaller as needed
+        st.image(load_logo(), width=200)  # Adjust width to make the logo larger or smaller as needed
 
         # Use custom HTML to centralize and increase the title size
         st.markdown("""
@@ -288,11 +453,19 @@ def display_sidebar():
 
 # Main function to control the flow
 def main():
+    warm_up()
     if "page" not in st.session_state:
         st.session_state["page"] = "login_signup"
 
+    # Time the whole rerun, attributed to the page it started on
+    with instrumentation.rerun(st.session_state["page"], st.session_state):
+        route()
+
+def route():
     # Navigation Menu for Authenticated Users
     if st.session_state["page"] != "login_signup":
+        from streamlit_option_menu import option_menu
+
         menu_options = ["Home", "Exams", "User Progress", "Logout"]
         menu_icons = ["house", "book", "file-bar-graph", "box-arrow-right"]
 
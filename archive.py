@@ -0,0 +1,317 @@
+import gzip
+import json
+import os
+import time
+from collections import defaultdict
+from itertools import groupby
+
+from instrumentation import logger
+
+# Archived answers live next to the database, one gzip JSON-lines file per day and run:
+#   <db>_archive/answers/date=YYYY-MM-DD/answers-<first id>-<last id>[.merged].jsonl.gz
+# A file only counts once it is listed in the database's AnswerArchive table, which
+# happens in the same transaction that deletes its rows from UserAnswers. A run
+# first writes a file per day and batch, then merges each day's files into one.
+ANSWER_COLUMNS = ("answer_id", "user_id", "question_id", "selected_answer", "is_correct", "session_id", "answered_at")
+
+# Timed before and after archiving, to report what it bought
+TIMED_QUERIES = [
+    ("answer count", "SELECT COUNT(*) FROM UserAnswers"),
+    ("per-question totals", "SELECT question_id, COUNT(*), TOTAL(is_correct) FROM UserAnswers GROUP BY question_id"),
+    ("per-user totals", "SELECT user_id, COUNT(*), TOTAL(is_correct) FROM UserAnswers GROUP BY user_id"),
+]
+
+
+def archive_dir(db_name):
+    return os.path.splitext(db_name)[0] + "_archive"
+
+
+def new_archive_files(conn, after_file_id=0):
+    # (file_id, path) of the archive files listed after `after_file_id`
+    return conn.execute("SELECT file_id, path FROM AnswerArchive WHERE file_id > ? ORDER BY file_id",
+                        (after_file_id,)).fetchall()
+
+
+def read_archived_answers(db_name, files, after_answer_id=0):
+    """Yields (answer_id, user_id, question_id, is_correct) from archive files, skipping ids <= after_answer_id.
+
+    To see every answer exactly once, list the files (new_archive_files) in the
+    same read transaction as the UserAnswers query they complement.
+    """
+    root = archive_dir(db_name)
+    for _, path in files:
+        with gzip.open(os.path.join(root, path), "rt", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if row["answer_id"] > after_answer_id:
+                    yield row["answer_id"], row["user_id"] or 0, row["question_id"] or 0, row["is_correct"]
+
+
+def _write_lines(root, path, lines):
+    full_path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    # Written under a temporary name so a reader never sees half a file
+    with gzip.open(full_path + ".tmp", "wt", encoding="utf-8") as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(full_path + ".tmp", full_path)
+    return os.path.getsize(full_path)
+
+
+def _write_file(root, date, rows):
+    path = os.path.join("answers", f"date={date}", f"answers-{rows[0][0]}-{rows[-1][0]}.jsonl.gz")
+    size = _write_lines(root, path, (json.dumps(dict(zip(ANSWER_COLUMNS, row)), separators=(",", ":")) + "\n"
+                                     for row in rows))
+    return path, date, rows[0][0], rows[-1][0], len(rows), size
+
+
+def _remove_unlisted(conn, root):
+    # Files left by an earlier run: merged away, or written for a batch that wasn't recorded.
+    # Kept until then rather than removed at once, as a reader may still be going through them.
+    listed = {os.path.normpath(path) for (path,) in conn.execute("SELECT path FROM AnswerArchive")}
+    for directory, _, names in os.walk(os.path.join(root, "answers")):
+        for name in names:
+            full_path = os.path.join(directory, name)
+            if os.path.relpath(full_path, root) not in listed:
+                os.remove(full_path)
+
+
+def _merge_partitions(db, root, after_file_id):
+    # One file per day for this run's files (those listed after `after_file_id`), so the
+    # number of files grows with the days archived rather than with days times batches
+    conn = db._get_connection()
+    try:
+        days = conn.execute(
+            "SELECT partition_date FROM AnswerArchive WHERE file_id > ? GROUP BY partition_date HAVING COUNT(*) > 1",
+            (after_file_id,)
+        ).fetchall()
+        for (date,) in days:
+            files = conn.execute(
+                "SELECT file_id, path, first_answer_id, last_answer_id, rows FROM AnswerArchive "
+                "WHERE file_id > ? AND partition_date = ? ORDER BY file_id",
+                (after_file_id, date)
+            ).fetchall()
+            first = min(file[2] for file in files)
+            last = max(file[3] for file in files)
+            path = os.path.join("answers", f"date={date}", f"answers-{first}-{last}.merged.jsonl.gz")
+
+            def lines():
+                for file in files:
+                    with gzip.open(os.path.join(root, file[1]), "rt", encoding="utf-8") as f:
+                        yield from f
+
+            size = _write_lines(root, path, lines())
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("DELETE FROM AnswerArchive WHERE file_id = ?", [(file[0],) for file in files])
+                conn.execute(
+                    "INSERT INTO AnswerArchive (path, partition_date, first_answer_id, last_answer_id, rows, bytes) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, date, first, last, sum(file[4] for file in files), size)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    finally:
+        db._release_connection(conn)
+
+
+def _write_files(root, rows):
+    # One file per day in the batch; rows are ANSWER_COLUMNS plus the question type
+    return [_write_file(root, date, sorted(day_rows)) for date, day_rows in groupby(rows, key=lambda row: row[6][:10])]
+
+
+def _record_batch(conn, rows, files):
+    # Runs inside the caller's write transaction. False if some answers changed or
+    # went away since they were read (their user deleted or moved): nothing is recorded.
+    deleted = conn.executemany("DELETE FROM UserAnswers WHERE answer_id = ? AND answered_at = ?",
+                               [(row[0], row[6]) for row in rows]).rowcount
+    if deleted != len(rows):
+        return False
+
+    user_totals = defaultdict(lambda: [0, 0, None])
+    question_totals = defaultdict(lambda: [0, 0])
+    for _, user_id, question_id, _, is_correct, _, answered_at, question_type in rows:
+        if user_id is not None:
+            total = user_totals[user_id, question_type]
+            total[0] += 1
+            total[1] += bool(is_correct)
+            total[2] = max(total[2] or answered_at, answered_at)
+        total = question_totals[question_id]
+        total[0] += 1
+        total[1] += bool(is_correct)
+    conn.executemany(
+        "INSERT INTO UserAnswerSummary (user_id, question_type, attempts, correct, last_answered_at) "
+        "VALUES (?, ?, ?, ?, ?) ON CONFLICT (user_id, question_type) DO UPDATE SET "
+        "attempts = attempts + excluded.attempts, correct = correct + excluded.correct, "
+        "last_answered_at = MAX(last_answered_at, excluded.last_answered_at)",
+        [(user_id, question_type, *total) for (user_id, question_type), total in user_totals.items()]
+    )
+    conn.executemany(
+        "INSERT INTO QuestionAnswerSummary (question_id, attempts, correct) VALUES (?, ?, ?) "
+        "ON CONFLICT (question_id) DO UPDATE SET "
+        "attempts = attempts + excluded.attempts, correct = correct + excluded.correct",
+        [(question_id, *total) for question_id, total in question_totals.items()]
+    )
+    conn.executemany(
+        "INSERT INTO AnswerArchive (path, partition_date, first_answer_id, last_answer_id, rows, bytes) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        files
+    )
+    return True
+
+
+def archive_answers(db, older_than_days, batch_size=5000, pause=0.05):
+    """Moves answers older than `older_than_days` into archive files, keeping their totals per user and question.
+
+    Each batch of `batch_size` answers is read and written out to files first;
+    only the deletes and totals then run in a write transaction, with a pause
+    between batches, so the app's writes never wait for the file work.
+    Answers of exams still in progress, and answers to questions no longer
+    in the bank, are left alone. Each day's files are then merged into one.
+    Finished exam sessions older than the window are deleted too. Only one
+    run at a time per database. Returns (answers, files, bytes written,
+    sessions deleted).
+    """
+    root = archive_dir(db.db_name)
+    window = f"-{int(older_than_days)} days"
+    # From the question bank, which for a shard is another file
+    question_types = dict(db.question_types())
+    conn = db._get_connection()
+    try:
+        _remove_unlisted(conn, root)
+        first_file_id = conn.execute("SELECT IFNULL(MAX(file_id), 0) FROM AnswerArchive").fetchone()[0]
+    finally:
+        db._release_connection(conn)
+    answers = 0
+    after = ("", 0)
+    while True:
+        conn = db._get_connection()
+        try:
+            fetched = conn.execute(
+                f"SELECT {', '.join(ANSWER_COLUMNS)} FROM UserAnswers "
+                "WHERE answered_at < datetime('now', ?) AND (answered_at, answer_id) > (?, ?) "
+                "AND (session_id IS NULL OR session_id NOT IN "
+                "(SELECT session_id FROM ExamSessions WHERE status = 'active')) "
+                "ORDER BY answered_at, answer_id LIMIT ?",
+                (window, *after, batch_size)
+            ).fetchall()
+            if not fetched:
+                break
+            after = (fetched[-1][6], fetched[-1][0])
+            # Answers to questions missing from the bank stay put: their totals couldn't be rolled up
+            rows = [row + (question_types[row[2]],) for row in fetched if row[2] in question_types]
+            recorded = False
+            if rows:
+                batch_files = _write_files(root, rows)
+                conn.execute("BEGIN IMMEDIATE")
+                recorded = _record_batch(conn, rows, batch_files)
+                if recorded:
+                    conn.commit()
+                else:
+                    # Left for the next run; the unlisted files are never read
+                    conn.rollback()
+                    for file in batch_files:
+                        os.remove(os.path.join(root, file[0]))
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            db._release_connection(conn)
+        if recorded:
+            answers += len(rows)
+        time.sleep(pause)
+
+    _merge_partitions(db, root, first_file_id)
+    conn = db._get_connection()
+    try:
+        files, written = conn.execute("SELECT COUNT(*), IFNULL(SUM(bytes), 0) FROM AnswerArchive WHERE file_id > ?",
+                                      (first_file_id,)).fetchone()
+    finally:
+        db._release_connection(conn)
+
+    sessions = 0
+    while True:
+        conn = db._get_connection()
+        try:
+            deleted = conn.execute(
+                "DELETE FROM ExamSessions WHERE session_id IN (SELECT session_id FROM ExamSessions "
+                "WHERE status IN ('finished', 'expired') AND updated_at < datetime('now', ?) LIMIT ?)",
+                (window, batch_size)
+            ).rowcount
+            conn.commit()
+        finally:
+            db._release_connection(conn)
+        sessions += deleted
+        if deleted < batch_size:
+            break
+        time.sleep(pause)
+
+    logger.info("Archived %d answers from %s into %d files (%d bytes)", answers, db.db_name, files, written)
+    return answers, files, written, sessions
+
+
+def database_size(db):
+    # (file size, bytes in free pages) of the main database, from its page counts
+    conn = db._get_connection()
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return pages * page_size, free * page_size
+    finally:
+        db._release_connection(conn)
+
+
+def enable_incremental_vacuum(db):
+    """One full VACUUM, switching the file to auto_vacuum=INCREMENTAL. Blocks writers while it runs."""
+    conn = db._get_connection()
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        db._release_connection(conn)
+
+
+def compact(db, pages_per_step=1000, pause=0.05):
+    """Returns freed pages to the filesystem a step at a time, then refreshes planner statistics.
+
+    Only databases with auto_vacuum=INCREMENTAL can shrink without a full
+    VACUUM; on others the freed pages stay in the file and are reused by
+    later inserts. Returns whether the file could be shrunk.
+    """
+    conn = db._get_connection()
+    try:
+        incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        if incremental:
+            while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                conn.execute(f"PRAGMA incremental_vacuum({int(pages_per_step)})").fetchall()
+                time.sleep(pause)
+        # Sampled statistics: cheap enough to run on a live database
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        return incremental
+    finally:
+        db._release_connection(conn)
+
+
+def time_queries(db, repeat=3):
+    # {name: best of `repeat` seconds} for TIMED_QUERIES
+    conn = db._get_connection()
+    try:
+        timings = {}
+        for name, sql in TIMED_QUERIES:
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                conn.execute(sql).fetchall()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+        return timings
+    finally:
+        db._release_connection(conn)
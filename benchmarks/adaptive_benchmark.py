@@ -0,0 +1,109 @@
+"""Fixed 10 question papers vs adaptive exams on a simulated student population.
+
+Builds a question bank with known ("true") difficulties, fills UserAnswers
+with answers from simulated past students, loads the ItemBank from them and
+then examines new simulated students both ways. Reports how many questions
+each exam took, how far the ability estimate landed from the true ability,
+and the cost of picking a question.
+
+Usage: python benchmarks/adaptive_benchmark.py [students]
+"""
+
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from synthetic import EXAM_TYPES, create_database
+from adaptive import AdaptiveExamSession, ItemBank, estimate_ability, probability_correct
+from utilities import UserDatabase
+
+NUM_QUESTIONS = 20_000
+PAST_ANSWERS = 400_000
+PAPER_SIZE = 10
+
+
+def simulate_history(path, rng):
+    # Rasch answers from past students, so the bank's difficulties can be learned from UserAnswers
+    db = UserDatabase(path)
+    true_difficulty = [0.0] + [rng.gauss(0, 1.2) for _ in range(NUM_QUESTIONS)]
+    conn = db._get_connection()
+    try:
+        rows = []
+        for _ in range(PAST_ANSWERS // PAPER_SIZE):
+            ability = rng.gauss(0, 1)
+            for _ in range(PAPER_SIZE):
+                question_id = rng.randint(1, NUM_QUESTIONS)
+                correct = rng.random() < probability_correct(ability, true_difficulty[question_id])
+                rows.append((question_id, "A", correct))
+        conn.executemany("INSERT INTO UserAnswers (user_id, question_id, selected_answer, is_correct) "
+                         "VALUES (1, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        db._release_connection(conn)
+    return db, true_difficulty
+
+
+def main(num_students):
+    rng = random.Random(0)
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = create_database(os.path.join(tmp, "beta.db"), num_questions=NUM_QUESTIONS, num_users=1)
+        db, true_difficulty = simulate_history(path, rng)
+
+        bank = ItemBank(db)
+        start = time.perf_counter()
+        bank.refresh(force=True)
+        load_time = time.perf_counter() - start
+
+        exam_type = EXAM_TYPES[0]
+        conn = db._get_connection()
+        try:
+            ids = list(db.question_index.ids(conn, exam_type))
+        finally:
+            db._release_connection(conn)
+
+        fixed_errors, adaptive_errors, adaptive_lengths, adaptive_ses, fixed_ses = [], [], [], [], []
+        pick_time = picks = 0
+        for _ in range(num_students):
+            ability = rng.gauss(0, 1)
+
+            paper = rng.sample(ids, PAPER_SIZE)
+            responses = [rng.random() < probability_correct(ability, true_difficulty[q]) for q in paper]
+            estimate, se = estimate_ability([bank.difficulty(q) for q in paper], responses)
+            fixed_errors.append(estimate - ability)
+            fixed_ses.append(se)
+
+            exam = AdaptiveExamSession(exam_type)
+            start = time.perf_counter()
+            bank.extend(exam)
+            pick_time += time.perf_counter() - start
+            picks += 1
+            while not exam.finished:
+                question_id = exam.current_question_id()
+                correct = rng.random() < probability_correct(ability, true_difficulty[question_id])
+                exam.answer("A" if correct else "B", "A", bank.difficulty(question_id))
+                start = time.perf_counter()
+                bank.extend(exam)
+                pick_time += time.perf_counter() - start
+                picks += 1
+            adaptive_errors.append(exam.ability - ability)
+            adaptive_lengths.append(exam.answered)
+            adaptive_ses.append(exam.standard_error)
+
+    def rmse(errors):
+        return math.sqrt(sum(error * error for error in errors) / len(errors))
+
+    print(f"{NUM_QUESTIONS} questions, {PAST_ANSWERS} past answers, {num_students} simulated students")
+    print(f"item bank load: {load_time * 1000:.0f} ms, next-question pick: {pick_time / picks * 1e6:.1f} us")
+    print(f"{'exam':<10} {'questions':>10} {'ability RMSE':>13} {'mean SE':>8}")
+    print(f"{'fixed':<10} {PAPER_SIZE:>10.1f} {rmse(fixed_errors):>13.3f} {statistics.mean(fixed_ses):>8.3f}")
+    print(f"{'adaptive':<10} {statistics.mean(adaptive_lengths):>10.1f} {rmse(adaptive_errors):>13.3f} "
+          f"{statistics.mean(adaptive_ses):>8.3f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000)
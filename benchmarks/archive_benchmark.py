@@ -0,0 +1,76 @@
+"""What `manage.py archive` reclaims and how long the app's writes wait while it runs.
+
+Builds a synthetic database with answers spread over the last two years,
+switches it to incremental auto-vacuum (as new shards are created), then
+archives everything older than the retention window while a writer thread
+keeps recording answers. Reports the file size, the answer queries' times
+before and after, and the writer's worst wait.
+
+Usage: python benchmarks/archive_benchmark.py [answers] [older_than_days]
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from synthetic import create_database
+import archive
+from utilities import UserDatabase
+
+HISTORY_DAYS = 730
+
+
+def main(num_answers, older_than_days):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = create_database(os.path.join(tmp, "beta.db"), num_questions=20_000, num_users=2_000,
+                               num_answers=num_answers)
+        db = UserDatabase(path)
+        conn = db._get_connection()
+        try:
+            conn.execute("UPDATE UserAnswers SET answered_at = datetime('now', '-' || (answer_id * ? / ?) || ' days')",
+                         (HISTORY_DAYS, num_answers))
+            conn.commit()
+        finally:
+            db._release_connection(conn)
+        archive.enable_incremental_vacuum(db)
+
+        size_before, _ = archive.database_size(db)
+        timings_before = archive.time_queries(db)
+
+        waits, stop = [], threading.Event()
+        session_id = db.start_exam_session(1, db.question_type(1), [1])
+
+        def writer():
+            while not stop.is_set():
+                start = time.perf_counter()
+                db.record_answer(session_id, 1, 1, "A", True)
+                waits.append(time.perf_counter() - start)
+                time.sleep(0.01)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        start = time.perf_counter()
+        answers, files, written, _ = archive.archive_answers(db, older_than_days)
+        archive.compact(db)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        thread.join()
+
+        size_after, _ = archive.database_size(db)
+        timings_after = archive.time_queries(db)
+
+        print(f"{num_answers} answers over {HISTORY_DAYS} days, archived {answers} older than {older_than_days} days "
+              f"into {files} files ({written / 2**20:.1f} MB) in {elapsed:.1f} s")
+        print(f"database {size_before / 2**20:.1f} MB -> {size_after / 2**20:.1f} MB")
+        for name, before in timings_before.items():
+            print(f"  {name:<20} {before * 1000:>8.2f} ms -> {timings_after[name] * 1000:>8.2f} ms")
+        print(f"concurrent record_answer: {len(waits)} writes, median {statistics.median(waits) * 1000:.1f} ms, "
+              f"worst {max(waits) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 180)
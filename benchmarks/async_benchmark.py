@@ -0,0 +1,88 @@
+"""Data-loading latency of progress() and admin_dashboard(): one call after another vs awaited together.
+
+Each page's lookups are issued the way app.py used to (sequentially on the
+script thread) and the way it does now (AsyncUserDatabase + run_all).
+--latency-ms adds a fixed wait to every lookup, standing in for storage that
+isn't in the page cache (cold start, network volumes).
+
+Usage: python benchmarks/async_benchmark.py [--users N] [--answers N] [--latency-ms MS]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from synthetic import create_database
+from analytics import AnswerAnalytics
+from async_database import AsyncUserDatabase, run_all
+from utilities import UserDatabase
+
+REPEAT = 50
+
+
+def timed(func):
+    samples = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples) * 1000, samples[int(0.95 * len(samples))] * 1000
+
+
+def with_latency(func, latency):
+    if not latency:
+        return func
+
+    def call(*args):
+        time.sleep(latency)
+        return func(*args)
+    return call
+
+
+def main(num_users, num_answers, latency_ms):
+    latency = latency_ms / 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = create_database(os.path.join(tmp, "beta.db"), num_questions=10_000,
+                               num_users=num_users, num_answers=num_answers)
+        db = UserDatabase(path)
+        adb = AsyncUserDatabase(db)
+        analytics = AnswerAnalytics(db, min_refresh_interval=0)
+        analytics.refresh()
+        user_id = num_users // 2
+        # A page deep into the user list, where OFFSET makes get_users_page do real work
+        page = num_users // 50 // 2
+
+        pages = {
+            "progress": [(db.get_user_details, user_id), (db.get_user_progress, user_id)],
+            "admin_dashboard": [(db.count_users,), (db.get_users_page, page), (analytics.refresh,)],
+        }
+
+        print(f"{num_users} users, {num_answers} answers, {latency_ms} ms added latency, "
+              f"{os.cpu_count()} CPUs, median/p95 of {REPEAT} loads")
+        print(f"{'page':<16} {'sequential ms':>18} {'concurrent ms':>18} {'change':>8}")
+        for name, calls in pages.items():
+            calls = [(with_latency(func, latency), *args) for func, *args in calls]
+
+            def sequential():
+                return [func(*args) for func, *args in calls]
+
+            def concurrent():
+                return run_all(*(adb.run(func, *args) for func, *args in calls))
+
+            concurrent()  # start the executor threads and their connections
+            seq_median, seq_p95 = timed(sequential)
+            con_median, con_p95 = timed(concurrent)
+            print(f"{name:<16} {seq_median:>8.2f} / {seq_p95:>7.2f} {con_median:>8.2f} / {con_p95:>7.2f} "
+                  f"{con_median / seq_median - 1:>+8.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--answers", type=int, default=500_000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    main(args.users, args.answers, args.latency_ms)
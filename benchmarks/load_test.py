@@ -0,0 +1,231 @@
+"""Headless load test of the exam flow against a synthetic beta.db.
+
+Simulates concurrent students doing login -> exams() -> take_exam() ->
+save_exam_results_frontend(), either through the real page functions with
+Streamlit's AppTest (--mode app) or straight against UserDatabase (--mode db).
+AppTest can only run one script at a time per process, so in app mode the
+students' steps interleave rather than overlap; db mode is fully concurrent.
+
+    python benchmarks/load_test.py --students 20 --save baseline.json
+    python benchmarks/load_test.py --students 20 --compare baseline.json
+
+Reports p50/p95/p99 per step, throughput and time spent waiting for a
+database connection.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from synthetic import EXAM_TYPES, create_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MENU_KEY = "_load_test_menu"
+
+_apptest_lock = threading.Lock()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else 0.0
+
+
+class Timings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.steps = {}
+
+    def record(self, step, seconds):
+        with self._lock:
+            self.steps.setdefault(step, []).append(seconds)
+
+    def timed(self, step, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.record(step, time.perf_counter() - start)
+        return result
+
+
+def student_app(timings, student):
+    from streamlit.testing.v1 import AppTest
+
+    def run(step, at):
+        # AppTest shares one mock Streamlit runtime per process, so script runs can't overlap;
+        # students interleave step by step and only the run itself is timed
+        with _apptest_lock:
+            timings.timed(step, at.run)
+        if at.exception:
+            raise RuntimeError(f"{step}: {at.exception[0].message}")
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    run("load", at)
+
+    at.text_input(key="login_username").input(f"user{student}")
+    at.text_input(key="login_password").input("password")
+    at.button[0].click()
+    run("login", at)
+
+    at.session_state[MENU_KEY] = "Exams"
+    run("exams", at)
+
+    exam_type = EXAM_TYPES[student % len(EXAM_TYPES)]
+    next(button for button in at.button if button.label == exam_type).click()
+    run("start_exam", at)
+
+    while at.session_state["page"] == "take_exam":
+        submit = [button for button in at.button if button.label == "Submit Answer"]
+        if not submit:
+            break
+        exam = at.session_state["exam"]
+        remaining = len(exam) - exam.answered
+        submit[0].click()
+        run("save_results" if remaining == 1 else "take_exam", at)
+
+
+def student_db(timings, student, db):
+    username = f"user{student}"
+    if not timings.timed("login", db.authenticate_user, username, "password"):
+        raise RuntimeError(f"login failed for {username}")
+    timings.timed("exams", db.is_admin, username)
+    user_id = db.get_user_id(username)
+    exam_type = EXAM_TYPES[student % len(EXAM_TYPES)]
+    question_ids = db.sample_question_ids(exam_type)
+    session_id = timings.timed("start_exam", db.start_exam_session, user_id, exam_type, question_ids)
+    for question in db.get_questions(question_ids):
+        timings.timed("take_exam", db.record_answer, session_id, user_id, question[0], "A", question[6] == "A")
+    timings.timed("save_results", db.finish_exam_session, session_id)
+
+
+def run_load(args):
+    from utilities import UserDatabase
+
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    cwd = os.getcwd()
+    try:
+        password_hash = bcrypt.hashpw(b"password", bcrypt.gensalt(args.bcrypt_rounds)).decode("utf-8")
+        create_database(os.path.join(workdir, "beta.db"), num_questions=args.questions, num_users=args.users,
+                        num_answers=args.answers, password_hash=password_hash)
+        shutil.copy(os.path.join(ROOT, "logo.png"), workdir)
+        # app.py opens beta.db and logo.png relative to the working directory
+        os.chdir(workdir)
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+
+        timings = Timings()
+        if args.mode == "app":
+            import streamlit as st
+            import streamlit_option_menu
+
+            # The option menu is a custom component, which AppTest can't click; read it from session state
+            streamlit_option_menu.option_menu = lambda **kwargs: st.session_state.get(MENU_KEY, "Home")
+
+            def student(i):
+                return student_app(timings, i)
+        else:
+            db = UserDatabase("beta.db", bcrypt_rounds=args.bcrypt_rounds)
+
+            def student(i):
+                return student_db(timings, i, db)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.students) as pool:
+            for future in [pool.submit(student, i % args.users) for i in range(args.students * args.rounds)]:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        pool_stats = UserDatabase("beta.db").pool_stats()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    sessions = args.students * args.rounds
+    return {
+        "commit": _git_commit(),
+        "config": vars(args) | {"save": None, "compare": None},
+        "sessions": sessions,
+        "elapsed": elapsed,
+        "throughput": sessions / elapsed,
+        "steps": {
+            step: {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+            }
+            for step, values in timings.steps.items()
+        },
+        "db_wait": {
+            "pool_waits": pool_stats["waits"],
+            "pool_wait_time": pool_stats["wait_time"],
+        },
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results, baseline=None, threshold=0.2):
+    print(f"{results['sessions']} sessions in {results['elapsed']:.2f}s "
+          f"({results['throughput']:.1f} students/s)")
+    print(f"{'step':<14} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}" + ("  p95 vs baseline" if baseline else ""))
+    regressions = []
+    for step, stats in results["steps"].items():
+        line = f"{step:<14} {stats['count']:>6} {stats['p50'] * 1000:>9.2f} {stats['p95'] * 1000:>9.2f} {stats['p99'] * 1000:>9.2f}"
+        previous = (baseline or {}).get("steps", {}).get(step)
+        if previous and previous["p95"]:
+            change = stats["p95"] / previous["p95"] - 1
+            line += f"  {change:+.0%}"
+            if change > threshold:
+                regressions.append(step)
+        print(line)
+    wait = results["db_wait"]
+    print(f"db wait: {wait['pool_waits']} pool waits ({wait['pool_wait_time'] * 1000:.1f} ms)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["app", "db"], default="app")
+    parser.add_argument("--students", type=int, default=10, help="Concurrent students")
+    parser.add_argument("--rounds", type=int, default=1, help="Exams per student")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--questions", type=int, default=10_000)
+    parser.add_argument("--answers", type=int, default=100_000)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--save", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Compare p95 per step with this JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed p95 slowdown before failing")
+    args = parser.parse_args()
+
+    results = run_load(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("config", {}).get("mode") != args.mode:
+            print(f"Note: baseline was recorded in {baseline.get('config', {}).get('mode')} mode.")
+    regressions = report(results, baseline, args.threshold)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        print(f"p95 regressed by more than {args.threshold:.0%} in: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Logins per second against bcrypt worker count and cost factor.
+
+Usage: python benchmarks/login_benchmark.py [--logins N] [--costs 10 12] [--workers 1 2 4]
+
+Each worker count runs in a fresh interpreter because the hashing pool is
+created once per process.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_one(workers, cost, logins):
+    # Runs inside the child interpreter
+    import bcrypt
+    from synthetic import create_database
+    from utilities import UserDatabase
+
+    with tempfile.TemporaryDirectory() as tmp:
+        password_hash = bcrypt.hashpw(b"password", bcrypt.gensalt(cost)).decode("utf-8")
+        path = create_database(os.path.join(tmp, "logins.db"), num_users=logins, password_hash=password_hash)
+        db = UserDatabase(path, bcrypt_rounds=cost)
+        db.authenticate_user("user0", "password")  # start the worker processes
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers * 4) as pool:
+            results = list(pool.map(lambda i: db.authenticate_user(f"user{i}", "password"), range(logins)))
+        elapsed = time.perf_counter() - start
+
+    assert all(results)
+    return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--costs", type=int, nargs="+", default=[10, 12])
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1} & set(range(1, (os.cpu_count() or 1) + 1))))
+    parser.add_argument("--child", nargs=2, type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        workers, cost = args.child
+        print(json.dumps(run_one(workers, cost, args.logins)))
+        return
+
+    print(f"{'workers':>8} {'cost':>5} {'logins/s':>10}")
+    for cost in args.costs:
+        for workers in args.workers:
+            env = dict(os.environ, BCRYPT_WORKERS=str(workers))
+            output = subprocess.run(
+                [sys.executable, __file__, "--logins", str(args.logins), "--child", str(workers), str(cost)],
+                env=env, capture_output=True, text=True, check=True,
+            ).stdout
+            rate = json.loads(output.strip().splitlines()[-1])
+            print(f"{workers:>8} {cost:>5} {rate:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
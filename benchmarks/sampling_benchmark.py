@@ -0,0 +1,53 @@
+"""Compare ORDER BY RANDOM() with UserDatabase.get_random_questions.
+
+Usage: python benchmarks/sampling_benchmark.py [sizes...]
+"""
+
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from synthetic import EXAM_TYPES, create_database
+from utilities import UserDatabase
+
+ORDER_BY_RANDOM = """
+    SELECT question_id, question_text, option_a, option_b, option_c, option_d, correct_answer
+    FROM Questions
+    WHERE question_type = ?
+    ORDER BY RANDOM()
+    LIMIT ?;
+"""
+
+
+def time_per_call(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main(sizes):
+    print(f"{'questions':>10} {'ORDER BY RANDOM() ms':>22} {'indexed sample ms':>18} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = create_database(os.path.join(tmp, f"bench_{size}.db"), num_questions=size)
+            exam_type = EXAM_TYPES[0]
+
+            conn = sqlite3.connect(path)
+            baseline = time_per_call(lambda: conn.execute(ORDER_BY_RANDOM, (exam_type, 10)).fetchall(), 20)
+            conn.close()
+
+            db = UserDatabase(path)
+            with contextlib.redirect_stdout(io.StringIO()):
+                db.get_random_questions(exam_type)  # builds the id index once
+                sampled = time_per_call(lambda: db.get_random_questions(exam_type), 200)
+
+            print(f"{size:>10} {baseline:>22.3f} {sampled:>18.3f} {baseline / sampled:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
@@ -0,0 +1,81 @@
+"""Cost of leaving out a student's already answered questions, as their history grows.
+
+Compares a `NOT IN (SELECT question_id FROM UserAnswers WHERE user_id = ?)`
+query against get_question_history() + sample_question_ids() with the
+per-user SeenSet, for students with longer and longer histories. Also
+reports the size of the stored SeenSet blob.
+
+Usage: python benchmarks/seen_questions_benchmark.py [questions]
+"""
+
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from synthetic import EXAM_TYPES, create_database
+from seen_questions import SeenSet
+from utilities import UserDatabase
+
+HISTORY_SIZES = [0, 1_000, 10_000, 30_000, 100_000]
+REPEAT = 50
+
+
+def median_ms(func):
+    samples = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main(num_questions):
+    rng = random.Random(0)
+    exam_type = EXAM_TYPES[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = create_database(os.path.join(tmp, "beta.db"), num_questions=num_questions,
+                               num_users=len(HISTORY_SIZES))
+        db = UserDatabase(path)
+        conn = db._get_connection()
+        try:
+            ids = list(db.question_index.ids(conn, exam_type))
+            # One student per history size, answers spread over the whole type
+            for user_id, size in enumerate(HISTORY_SIZES, start=1):
+                answers = [rng.choice(ids) for _ in range(size)]
+                conn.executemany("INSERT INTO UserAnswers (user_id, question_id, selected_answer, is_correct) "
+                                 "VALUES (?, ?, 'A', 1)", [(user_id, question_id) for question_id in answers])
+                conn.execute("INSERT INTO UserSeenQuestions (user_id, question_type, seen) VALUES (?, ?, ?)",
+                             (user_id, exam_type, SeenSet(answers).to_bytes()))
+            conn.commit()
+        finally:
+            db._release_connection(conn)
+
+        print(f"{len(ids)} {exam_type.strip()} questions, median of {REPEAT} papers")
+        print(f"{'answers':>8} {'seen':>7} {'blob KB':>8} {'NOT IN ms':>10} {'SeenSet ms':>11} {'repeats':>8}")
+        for user_id, size in enumerate(HISTORY_SIZES, start=1):
+            def not_in():
+                conn = db._get_connection()
+                try:
+                    return conn.execute(
+                        "SELECT question_id FROM Questions WHERE question_type = ? AND question_id NOT IN "
+                        "(SELECT question_id FROM UserAnswers WHERE user_id = ?) ORDER BY RANDOM() LIMIT 10",
+                        (exam_type, user_id)
+                    ).fetchall()
+                finally:
+                    db._release_connection(conn)
+
+            def seen_set():
+                seen, review = db.get_question_history(user_id, exam_type)
+                return db.sample_question_ids(exam_type, 10, seen=seen, review=review)
+
+            seen, _ = db.get_question_history(user_id, exam_type)
+            repeats = sum(question_id in seen for _ in range(20) for question_id in seen_set())
+            print(f"{size:>8} {len(seen):>7} {len(seen.to_bytes()) / 1024:>8.1f} {median_ms(not_in):>10.2f} "
+                  f"{median_ms(seen_set):>11.3f} {repeats:>8}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,97 @@
+"""Bytes per active exam session: full question tuples vs ExamSession.
+
+Builds N finished exams the way take_exam used to keep them (question rows
+copied into session state, answers as a list of tuples) and as ExamSession
+objects resolving text through the shared question cache, and measures
+each with tracemalloc.
+
+Usage: python benchmarks/session_memory_benchmark.py [sessions] [db]
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+from synthetic import EXAM_TYPES, create_database
+from exam_session import OPTIONS, ExamSession
+from utilities import UserDatabase
+
+PAPER_SIZE = 10
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    sessions = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return sessions, total
+
+
+def main(num_sessions, db_path=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "beta.db")
+        if db_path:
+            shutil.copy(db_path, path)
+        else:
+            create_database(path, num_questions=20_000)
+        db = UserDatabase(path)
+        rng = random.Random(0)
+        papers = [(EXAM_TYPES[i % len(EXAM_TYPES)], db.sample_question_ids(EXAM_TYPES[i % len(EXAM_TYPES)], PAPER_SIZE))
+                  for i in range(num_sessions)]
+        choices = [[rng.choice(OPTIONS) for _ in range(PAPER_SIZE)] for _ in range(num_sessions)]
+
+        conn = db._get_connection()
+
+        def build_tuples():
+            # Every session fetched its own copy of each row into session state
+            sessions = []
+            for (exam_type, question_ids), selected in zip(papers, choices):
+                placeholders = ", ".join("?" * len(question_ids))
+                rows = conn.execute(f"""
+                    SELECT question_id, question_text, option_a, option_b, option_c, option_d, correct_answer
+                    FROM Questions WHERE question_id IN ({placeholders})
+                """, question_ids).fetchall()
+                sessions.append({
+                    "exam_questions_storage": {exam_type: rows},
+                    "exam_type": exam_type,
+                    "current_question_index": len(rows),
+                    "user_answers": [(row[0], option, option == row[6]) for row, option in zip(rows, selected)],
+                    "exam_saved": False,
+                })
+            return sessions
+
+        def build_sessions():
+            sessions = []
+            for (exam_type, question_ids), selected in zip(papers, choices):
+                session = ExamSession(exam_type, question_ids)
+                for question, option in zip(db.get_questions(question_ids), selected):
+                    session.answer(option, question[6])
+                sessions.append(session)
+            return sessions
+
+        tuple_sessions, tuple_bytes = measure(build_tuples)
+        del tuple_sessions
+        db._release_connection(conn)
+
+        # The shared question cache is paid once per process, however many sessions use it
+        db.cache.clear()
+        _, shared_bytes = measure(lambda: [db.get_questions(question_ids) for _, question_ids in papers])
+        compact_sessions, compact_bytes = measure(build_sessions)
+        compact_total = compact_bytes + shared_bytes
+
+    print(f"{num_sessions} active sessions, {PAPER_SIZE} questions each")
+    print(f"{'representation':<28} {'bytes/session':>14} {'total MB':>10}")
+    print(f"{'question tuples + answers':<28} {tuple_bytes / num_sessions:>14.0f} {tuple_bytes / 1e6:>10.2f}")
+    print(f"{'ExamSession':<28} {compact_bytes / num_sessions:>14.0f} {compact_bytes / 1e6:>10.2f}")
+    print(f"{'  + shared question cache':<28} {compact_total / num_sessions:>14.0f} {compact_total / 1e6:>10.2f}"
+          f"  ({shared_bytes / 1e6:.2f} MB shared)")
+    print(f"reduction: {tuple_bytes / compact_total:.1f}x overall, {tuple_bytes / compact_bytes:.1f}x per session")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5_000, sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,121 @@
+"""Exam write throughput with every tenant in one file vs spread over several shards.
+
+Worker processes (one per tenant) run the exam flow's writes back to back:
+start_exam_session, a record_answer per question, finish_exam_session.
+SQLite allows one writer per file, so with a single shard the workers take
+turns on its write lock; with N shards only the tenants sharing a file do.
+Reports completed sessions per second for each shard count. Scaling is
+capped by the CPUs available, so compare runs on the same machine.
+
+Afterwards it checks every shard's per-topic totals against its users'
+totals, before and after rebuild_user_aggregates(), and exits non-zero if
+they differ: shards other than the bank have no questions of their own,
+so question types must come from the bank.
+
+Usage: python benchmarks/shard_benchmark.py [--tenants N] [--seconds S] [--shards 1 2 4 8]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from synthetic import EXAM_TYPES, create_database
+
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+from sharding import ShardedUserDatabase  # noqa: E402
+
+
+def setup(workdir, num_tenants, num_shards):
+    bank = create_database(os.path.join(workdir, "beta.db"), num_questions=10_000)
+    db = ShardedUserDatabase(os.path.join(workdir, "catalog.db"), bank)
+    shard_ids = [0] + [db.add_shard(os.path.join(workdir, f"shard{i}.db")) for i in range(1, num_shards)]
+    for tenant in range(num_tenants):
+        db.add_tenant(f"tenant{tenant}", shard_ids[tenant % num_shards])
+        db.add_user(f"user{tenant}", "password", f"user{tenant}@example.com", "student", tenant=f"tenant{tenant}")
+        # One exam saved in one go, as well as the ones the workers take question by question
+        question_ids = db.sample_question_ids(EXAM_TYPES[tenant % len(EXAM_TYPES)])
+        db.save_exam_results_backend(db.get_user_id(f"user{tenant}"),
+                                     [(question_id, "A", False) for question_id in question_ids])
+
+
+def check_totals(workdir):
+    # Failures: shards whose per-topic totals don't add up to the users' totals
+    db = ShardedUserDatabase(os.path.join(workdir, "catalog.db"), os.path.join(workdir, "beta.db"))
+    failures = []
+    for when in ("after the run", "after rebuild_user_aggregates"):
+        if when != "after the run":
+            db.rebuild_user_aggregates()
+        for shard in db.shards():
+            conn = shard._get_connection()
+            try:
+                attempted = conn.execute("SELECT IFNULL(SUM(total_attempted), 0) FROM Users").fetchone()[0]
+                by_topic = conn.execute("SELECT IFNULL(SUM(questions_attempted), 0) FROM UserTopicStats").fetchone()[0]
+                untyped = conn.execute("SELECT COUNT(*) FROM UserProgress WHERE exam_type IS NULL").fetchone()[0]
+            finally:
+                shard._release_connection(conn)
+            if attempted != by_topic or untyped:
+                failures.append(f"{os.path.basename(shard.db_name)} {when}: {attempted} answers in the users' totals, "
+                                f"{by_topic} in the per-topic totals, {untyped} attempts without an exam type")
+    return failures
+
+
+def worker(workdir, tenant, seconds, start_at, results):
+    db = ShardedUserDatabase(os.path.join(workdir, "catalog.db"), os.path.join(workdir, "beta.db"))
+    user_id = db.get_user_id(f"user{tenant}")
+    exam_type = EXAM_TYPES[tenant % len(EXAM_TYPES)]
+    questions = db.get_questions(db.sample_question_ids(exam_type))
+    time.sleep(max(0.0, start_at - time.time()))
+    sessions = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        session_id = db.start_exam_session(user_id, exam_type, [question[0] for question in questions])
+        for question in questions:
+            db.record_answer(session_id, user_id, question[0], "A", question[6] == "A")
+        db.finish_exam_session(session_id)
+        sessions += 1
+    results.put(sessions)
+
+
+def run(num_tenants, num_shards, seconds):
+    with tempfile.TemporaryDirectory() as workdir:
+        setup(workdir, num_tenants, num_shards)
+        results = multiprocessing.Queue()
+        # Start together once every worker has opened its connections
+        start_at = time.time() + 2.0
+        processes = [multiprocessing.Process(target=worker, args=(workdir, tenant, seconds, start_at, results))
+                     for tenant in range(num_tenants)]
+        for process in processes:
+            process.start()
+        sessions = sum(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+        failures = check_totals(workdir)
+    return sessions / seconds, failures
+
+
+def main(num_tenants, seconds, shard_counts):
+    print(f"{num_tenants} tenants (one worker process each), {seconds:.0f} s per run, {os.cpu_count()} CPUs")
+    print(f"{'shards':>6} {'sessions/s':>11} {'answers/s':>10} {'vs 1 shard':>11}")
+    baseline = None
+    failures = []
+    for num_shards in shard_counts:
+        throughput, run_failures = run(num_tenants, num_shards, seconds)
+        failures += run_failures
+        baseline = baseline or throughput
+        print(f"{num_shards:>6} {throughput:>11.1f} {throughput * 10:>10.0f} {throughput / baseline:>10.2f}x")
+    for failure in failures:
+        print("FAIL " + failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    sys.exit(main(args.tenants, args.seconds, args.shards))
@@ -0,0 +1,83 @@
+"""Import time of app.py's module-level imports, from `python -X importtime`.
+
+Runs app.py's top-level import statements in fresh interpreters and reports
+the median total and the heaviest modules. Exits non-zero if the total is
+over the budget or if a module that the app imports lazily (pandas, numpy,
+bcrypt, the option menu) gets imported at startup again, so it can run as a
+CI check.
+
+Usage: python benchmarks/startup_benchmark.py [--budget-ms MS] [--runs N] [--app PATH]
+"""
+
+import argparse
+import ast
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed by some pages; importing any of these at startup is a regression
+LAZY_MODULES = ("pandas", "numpy", "bcrypt", "streamlit_option_menu", "analytics")
+
+
+def startup_imports(path):
+    # The app's module-level import statements, as source
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    tree = ast.parse(source)
+    return "\n".join(ast.get_source_segment(source, node) for node in tree.body
+                     if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def import_times(code):
+    # {top-level module: cumulative us} for one fresh interpreter, plus every module imported
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    top_level, imported = {}, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imported.add(name.strip())
+        if not name.startswith("  "):
+            top_level[name.strip()] = int(cumulative)
+    return top_level, imported
+
+
+def main(path, runs, budget_ms):
+    code = startup_imports(path)
+    totals, per_module, imported = [], {}, set()
+    for _ in range(runs):
+        top_level, names = import_times(code)
+        totals.append(sum(top_level.values()) / 1000)
+        imported |= names
+        for name, us in top_level.items():
+            per_module.setdefault(name, []).append(us / 1000)
+
+    total = statistics.median(totals)
+    print(f"app.py startup imports: {total:.0f} ms median of {runs} runs (budget {budget_ms:.0f} ms)")
+    heaviest = sorted(per_module.items(), key=lambda item: statistics.median(item[1]), reverse=True)[:10]
+    for name, samples in heaviest:
+        print(f"  {statistics.median(samples):>8.1f} ms  {name}")
+
+    failures = []
+    if total > budget_ms:
+        failures.append(f"startup imports take {total:.0f} ms, over the {budget_ms:.0f} ms budget")
+    leaked = sorted(module for module in LAZY_MODULES
+                    if any(name == module or name.startswith(module + ".") for name in imported))
+    if leaked:
+        failures.append(f"imported at startup but meant to be lazy: {', '.join(leaked)}")
+    for failure in failures:
+        print("FAIL " + failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=600.0)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"))
+    args = parser.parse_args()
+    sys.exit(main(args.app, args.runs, args.budget_ms))
@@ -0,0 +1,90 @@
+"""Helpers to build throwaway databases with the same schema as beta.db."""
+
+import os
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities import EXAM_TYPES  # noqa: E402
+
+SCHEMA = """
+CREATE TABLE Users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    user_type TEXT NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    total_attempted INTEGER DEFAULT 0,
+    total_correct INTEGER DEFAULT 0
+);
+CREATE TABLE Questions (
+    question_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question_text TEXT NOT NULL,
+    option_a TEXT NOT NULL,
+    option_b TEXT NOT NULL,
+    option_c TEXT NOT NULL,
+    option_d TEXT NOT NULL,
+    correct_answer TEXT NOT NULL,
+    question_type TEXT NOT NULL
+);
+CREATE TABLE UserProgress (
+    progress_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    questions_attempted INTEGER NOT NULL,
+    correct_answers INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    completed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
+);
+CREATE TABLE UserAnswers (
+    answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    question_id INTEGER,
+    selected_answer TEXT NOT NULL,
+    is_correct BOOLEAN NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (question_id) REFERENCES Questions(question_id) ON DELETE CASCADE
+);
+"""
+
+
+def create_database(path, num_questions=0, num_users=0, num_answers=0, password_hash="x", seed=0):
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+
+    conn.executemany(
+        "INSERT INTO Questions (question_text, option_a, option_b, option_c, option_d, correct_answer, question_type) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((f"Question {i}?", "one", "two", "three", "four", rng.choice("ABCD"), EXAM_TYPES[i % len(EXAM_TYPES)])
+         for i in range(num_questions)),
+    )
+    conn.executemany(
+        "INSERT INTO Users (username, password, email, user_type) VALUES (?, ?, ?, 'student')",
+        ((f"user{i}", password_hash, f"user{i}@example.com") for i in range(num_users)),
+    )
+
+    # Answers are written in exams of ten, with a matching UserProgress row
+    if num_users and num_questions:
+        for start in range(0, num_answers, 10):
+            user_id = rng.randint(1, num_users)
+            answers = [(user_id, rng.randint(1, num_questions), rng.choice("ABCD"), rng.random() < 0.6)
+                       for _ in range(min(10, num_answers - start))]
+            correct = sum(1 for answer in answers if answer[3])
+            conn.execute(
+                "INSERT INTO UserProgress (user_id, questions_attempted, correct_answers, score) VALUES (?, ?, ?, ?)",
+                (user_id, len(answers), correct, int(correct / len(answers) * 100)),
+            )
+            conn.executemany(
+                "INSERT INTO UserAnswers (user_id, question_id, selected_answer, is_correct) VALUES (?, ?, ?, ?)",
+                answers,
+            )
+
+    conn.commit()
+    conn.close()
+    return path
@@ -0,0 +1,67 @@
+from array import array
+
+OPTIONS = ("A", "B", "C", "D")
+
+
+class ExamSession:
+    """An in-progress exam, small enough to keep one per Streamlit session.
+
+    Only question ids and the answers given so far are stored: selected
+    options as one byte each (index into OPTIONS) and correctness as 0/1.
+    Question text is resolved through the shared question cache whenever a
+    question is displayed, so it is held once per process, not per session.
+    session_id is the ExamSessions row the answers are persisted under.
+    """
+
+    __slots__ = ("session_id", "exam_type", "question_ids", "selected", "correct", "answered", "saved")
+
+    def __init__(self, exam_type, question_ids, session_id=None):
+        self.session_id = session_id
+        self.exam_type = exam_type
+        self.question_ids = array("q", question_ids)
+        self.selected = bytearray(len(self.question_ids))
+        self.correct = bytearray(len(self.question_ids))
+        self.answered = 0
+        self.saved = False
+
+    @classmethod
+    def resume(cls, session_id, exam_type, question_ids, answers):
+        """Rebuilds a session from UserDatabase.get_active_exam_session()."""
+        session = cls(exam_type, question_ids, session_id)
+        given = {question_id: (selected, is_correct) for question_id, selected, is_correct in answers}
+        # Answers are submitted in paper order, so the answered ones form a prefix
+        for question_id in session.question_ids:
+            if question_id not in given:
+                break
+            selected, is_correct = given[question_id]
+            session.selected[session.answered] = OPTIONS.index(selected)
+            session.correct[session.answered] = bool(is_correct)
+            session.answered += 1
+        return session
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    @property
+    def finished(self):
+        return self.answered >= len(self.question_ids)
+
+    def current_question_id(self):
+        return None if self.finished else self.question_ids[self.answered]
+
+    def answer(self, option, correct_answer):
+        """Records the option chosen for the current question; returns whether it was correct."""
+        is_correct = option == correct_answer
+        self.selected[self.answered] = OPTIONS.index(option)
+        self.correct[self.answered] = is_correct
+        self.answered += 1
+        return is_correct
+
+    def total_correct(self):
+        return sum(self.correct[:self.answered])
+
+    def answers(self):
+        # (question_id, selected_answer, is_correct) rows, as save_exam_results_backend expects
+        return [(self.question_ids[i], OPTIONS[self.selected[i]], bool(self.correct[i]))
+                for i in range(self.answered)]
+
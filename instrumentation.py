@@ -0,0 +1,260 @@
+"""In-process metrics, Prometheus export and an opt-in sampling profiler.
+
+Environment variables (all optional):
+    MOCKEXAM_METRICS_PORT   serve /metrics on this port from a background thread
+    MOCKEXAM_METRICS_FILE   rewrite this file with the Prometheus text every 15s
+    MOCKEXAM_PROFILE        sample all threads and write collapsed stacks here at exit
+    MOCKEXAM_LOG_LEVEL      level for the "mockexam" logger (default WARNING)
+"""
+
+import atexit
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("mockexam")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000, 10_000)
+BYTES_BUCKETS = (1_000, 5_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram with one series per label value."""
+
+    def __init__(self, name, help, label, buckets):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, (counts, total, count) in sorted(self._series.items()):
+                label = f'{self.label}="{label_value}"'
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{label}}} {total}")
+                lines.append(f"{self.name}_count{{{label}}} {count}")
+        return lines
+
+
+db_call_seconds = Histogram("mockexam_db_call_seconds", "UserDatabase method latency.", "method", LATENCY_BUCKETS)
+db_rows = Histogram("mockexam_db_rows", "Rows returned per UserDatabase call.", "method", COUNT_BUCKETS)
+page_seconds = Histogram("mockexam_page_render_seconds", "Page function render time.", "page", LATENCY_BUCKETS)
+rerun_db_calls = Histogram("mockexam_rerun_db_calls", "UserDatabase calls per script rerun.", "page", COUNT_BUCKETS)
+session_state_bytes = Histogram("mockexam_session_state_bytes", "Approximate session state size.", "page", BYTES_BUCKETS)
+HISTOGRAMS = [db_call_seconds, db_rows, page_seconds, rerun_db_calls, session_state_bytes]
+
+# name -> function returning a dict of numbers, exported as gauges
+_collectors = {}
+
+_local = threading.local()
+
+
+def instrument_methods(cls):
+    """Class decorator timing every public method into mockexam_db_* histograms."""
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or not callable(method):
+            continue
+        setattr(cls, name, _timed(name, method))
+    return cls
+
+
+def _timed(name, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            db_call_seconds.observe(name, time.perf_counter() - start)
+            count_db_call()
+        db_rows.observe(name, len(result) if isinstance(result, list) else int(result is not None))
+        return result
+    return wrapper
+
+
+def count_db_call():
+    # Attributed to the current thread's rerun (see rerun())
+    _local.db_calls = getattr(_local, "db_calls", 0) + 1
+
+
+@contextmanager
+def rerun(page, session_state=None):
+    """Times one page render and the UserDatabase calls it made on this thread."""
+    _local.db_calls = 0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        page_seconds.observe(page, time.perf_counter() - start)
+        rerun_db_calls.observe(page, _local.db_calls)
+        if session_state is not None:
+            session_state_bytes.observe(page, _approximate_size(dict(session_state)))
+
+
+def _approximate_size(value, depth=0):
+    size = sys.getsizeof(value)
+    if depth > 4:
+        return size
+    if isinstance(value, dict):
+        size += sum(_approximate_size(k, depth + 1) + _approximate_size(v, depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_approximate_size(item, depth + 1) for item in value)
+    return size
+
+
+def register_collector(name, collect):
+    _collectors[name] = collect
+
+
+def render_prometheus():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for prefix, collect in sorted(_collectors.items()):
+        try:
+            values = collect() or {}
+        except Exception:
+            logger.exception("Metrics collector %s failed", prefix)
+            continue
+        for key, value in sorted(_flatten(values)):
+            lines.append(f"# TYPE {prefix}_{key} gauge")
+            lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _flatten(values, prefix=""):
+    for key, value in values.items():
+        key = "".join(c if c.isalnum() else "_" for c in f"{prefix}{key}".strip()).lower()
+        if isinstance(value, dict):
+            yield from _flatten(value, key + "_")
+        elif isinstance(value, (int, float)):
+            yield key, float(value)
+
+
+def write_prometheus(path):
+    # Write then rename so scrapers never see a half-written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval.
+
+    dump() writes collapsed stacks ("frame;frame;frame count" per line), the
+    input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def start_from_env():
+    """Starts whatever the environment asks for; only the first call per process does anything."""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+
+    logging.basicConfig()
+    logger.setLevel(os.environ.get("MOCKEXAM_LOG_LEVEL", "WARNING").upper())
+
+    port = os.environ.get("MOCKEXAM_METRICS_PORT")
+    if port:
+        serve_metrics(int(port))
+
+    metrics_file = os.environ.get("MOCKEXAM_METRICS_FILE")
+    if metrics_file:
+        def write_periodically():
+            while True:
+                time.sleep(15)
+                write_prometheus(metrics_file)
+        threading.Thread(target=write_periodically, name="metrics-file", daemon=True).start()
+        atexit.register(write_prometheus, metrics_file)
+
+    profile_path = os.environ.get("MOCKEXAM_PROFILE")
+    if profile_path:
+        profiler = SamplingProfiler()
+        profiler.start()
+        atexit.register(profiler.dump, profile_path)
@@ -0,0 +1,232 @@
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+import archive
+from adaptive import ItemBank
+from sharding import ShardedUserDatabase
+from utilities import UserDatabase
+
+# Tables that grow with usage; a plain scan of any of these is a regression
+LARGE_TABLES = ("Questions", "UserProgress", "UserAnswers", "ExamSessions", "UserTopicStats", "ReviewQueue",
+                "UserAnswerSummary")
+
+
+def rebuild_aggregates(db, args):
+    updated = db.rebuild_user_aggregates()
+    print(f"Rebuilt progress totals for {updated} users.")
+
+
+def migrate(db, args):
+    # UserDatabase applies pending migrations when it is created
+    print(f"Schema is at version {db.schema_version()}.")
+
+
+def expire_sessions(db, args):
+    finished, expired = db.expire_exam_sessions(args.idle_minutes * 60)
+    print(f"Finished {finished} abandoned exam sessions, expired {expired} with no answers.")
+
+
+def archive_answers(db, args):
+    # Safe on a live database: short write transactions, and freed pages returned a step at a time
+    for shard in db.shards():
+        size_before, _ = archive.database_size(shard)
+        timings_before = archive.time_queries(shard)
+        answers, files, written, sessions = archive.archive_answers(shard, args.older_than_days, args.batch_size)
+        if args.full_vacuum:
+            archive.enable_incremental_vacuum(shard)
+        shrunk = archive.compact(shard)
+        size_after, free = archive.database_size(shard)
+        timings_after = archive.time_queries(shard)
+
+        print(f"{shard.db_name}: archived {answers} answers older than {args.older_than_days} days into {files} files "
+              f"({written / 1024:.0f} KB) under {archive.archive_dir(shard.db_name)}; "
+              f"deleted {sessions} finished exam sessions.")
+        print(f"  database {size_before / 2**20:.1f} MB -> {size_after / 2**20:.1f} MB "
+              f"({max(size_before - size_after, 0) / 2**20:.1f} MB reclaimed)")
+        if not shrunk and free:
+            print(f"  {free / 2**20:.1f} MB of free pages will be reused by new rows; the file only shrinks after a "
+                  "one-off --full-vacuum (blocks writers while it runs)")
+        for name, before in timings_before.items():
+            after = timings_after[name]
+            print(f"  {name:<20} {before * 1000:>8.2f} ms -> {after * 1000:>8.2f} ms ({after / before - 1:+.0%})")
+
+
+def _sharded(db):
+    if not isinstance(db, ShardedUserDatabase):
+        sys.exit("This command needs --catalog.")
+    return db
+
+
+def add_shard(db, args):
+    shard_id = _sharded(db).add_shard(args.path)
+    print(f"Added shard {shard_id} at {args.path}.")
+
+
+def add_tenant(db, args):
+    shard_id = _sharded(db).add_tenant(args.tenant, args.shard)
+    print(f"Tenant {args.tenant} placed on shard {shard_id}.")
+
+
+def move_tenant(db, args):
+    moved = _sharded(db).move_tenant(args.tenant, args.shard, args.grace_period)
+    print(f"Moved {moved} users of {args.tenant} to shard {args.shard}.")
+
+
+def list_tenants(db, args):
+    print(f"{'tenant':<20} {'shard':>5} {'users':>8}  {'state':<7} path")
+    for tenant, shard_id, path, state, users in _sharded(db).list_tenants():
+        print(f"{tenant:<20} {shard_id:>5} {users:>8}  {state:<7} {path}")
+
+
+def _copy_schema(source_path, target_path):
+    source = sqlite3.connect(source_path)
+    try:
+        version = source.execute("PRAGMA user_version").fetchone()[0]
+        ddl = [sql for (sql,) in source.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY type = 'index'"
+        )]
+    finally:
+        source.close()
+
+    target = sqlite3.connect(target_path)
+    try:
+        for statement in ddl:
+            target.execute(statement)
+        target.execute(f"PRAGMA user_version = {version}")
+        target.executemany(
+            "INSERT INTO Questions (question_text, option_a, option_b, option_c, option_d, correct_answer, question_type) "
+            "VALUES (?, 'a', 'b', 'c', 'd', 'A', 'VERBAL ABILITY')",
+            [(f"Question {i}?",) for i in range(20)],
+        )
+        target.commit()
+    finally:
+        target.close()
+
+
+def _exercise_queries(db):
+    # Every query the app issues, driven through UserDatabase
+    db.add_user("plan_user", "password", "plan_user@example.com", "student")
+    db.find_user("plan_user", "plan_user@example.com")
+    db.authenticate_user("plan_user", "password")
+    db.is_admin("plan_user")
+    user_id = db.get_user_id("plan_user")
+    db.get_user_details(user_id)
+    db.appoint_admin("plan_user")
+    db.remove_admin("plan_user")
+    questions = db.get_random_questions("VERBAL ABILITY")
+    db.save_exam_results_backend(user_id, [(question[0], "A", True) for question in questions])
+    db.get_user_progress(user_id)
+    history = db.get_exam_history(user_id)
+    db.get_exam_history(user_id, before=(history[-1][1], history[-1][0]))
+    db.get_exam_history(user_id, exam_type="VERBAL ABILITY")
+    db.get_topic_stats(user_id)
+    seen, review = db.get_question_history(user_id, "VERBAL ABILITY")
+    db.sample_question_ids("VERBAL ABILITY", exclude=[questions[0][0]], seen=seen, review=review)
+    session_id = db.start_exam_session(user_id, "VERBAL ABILITY", [question[0] for question in questions])
+    db.record_answer(session_id, user_id, questions[0][0], "A", True)
+    db.get_active_exam_session(user_id)
+    db.finish_exam_session(session_id)
+    bank = ItemBank(db)
+    bank.refresh(force=True)
+    db.record_answer(db.start_exam_session(user_id, "VERBAL ABILITY", [questions[1][0]], adaptive=True),
+                     user_id, questions[1][0], "B", False)
+    bank.refresh(force=True)
+    db.expire_exam_sessions(0)
+    archive.archive_answers(db, 0, pause=0)
+    bank.refresh()
+    db.get_all_users()
+    db.count_users()
+    db.get_users_page(0)
+
+
+def check_query_plans(db, args):
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "query_plans.db")
+        _copy_schema(args.db, path)
+        plan_db = UserDatabase(path)
+
+        statements = []
+        conn = plan_db._get_connection()
+        conn.set_trace_callback(statements.append)
+        try:
+            _exercise_queries(plan_db)
+        finally:
+            conn.set_trace_callback(None)
+
+        try:
+            seen = set()
+            for statement in statements:
+                statement = " ".join(statement.split())
+                # Same query with different parameters only needs checking once
+                shape = re.sub(r"'[^']*'|\b\d+\b", "?", statement)
+                if shape in seen or not re.match(r"(SELECT|INSERT|UPDATE|DELETE|WITH)\b", statement, re.I):
+                    continue
+                seen.add(shape)
+
+                plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + statement)]
+                scans = [detail for detail in plan
+                         if re.match(rf"SCAN ({'|'.join(LARGE_TABLES)})\b", detail) and "COVERING INDEX" not in detail]
+                failures += bool(scans)
+                print(("FAIL " if scans else "ok   ") + statement[:100])
+                for detail in plan:
+                    print(f"       {detail}")
+        finally:
+            plan_db._release_connection(conn)
+
+    if failures:
+        print(f"{failures} queries fall back to a full scan of a large table.")
+        sys.exit(1)
+    print("No full scans of large tables.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the mock examination database.")
+    parser.add_argument("--db", default="beta.db", help="Path to the SQLite database (default: beta.db)")
+    parser.add_argument("--catalog", help="Shard catalog; commands then cover every shard (--db is the question bank)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("rebuild-aggregates", help="Recompute per-user totals on Users from UserProgress")
+    commands.add_parser("migrate", help="Apply pending schema migrations")
+    commands.add_parser("check-query-plans", help="Fail if any app query does a full scan of a large table")
+    expire = commands.add_parser("expire-sessions", help="Finish or expire exam sessions left idle (run periodically, e.g. from cron)")
+    expire.add_argument("--idle-minutes", type=int, default=60, help="Idle time before a session is closed (default: 60)")
+    shard = commands.add_parser("add-shard", help="Create and register a shard file (needs --catalog)")
+    shard.add_argument("path")
+    tenant = commands.add_parser("add-tenant", help="Add a tenant, on the given or the least used shard (needs --catalog)")
+    tenant.add_argument("tenant")
+    tenant.add_argument("--shard", type=int)
+    move = commands.add_parser("move-tenant", help="Move a tenant's users and history to another shard (needs --catalog)")
+    move.add_argument("tenant")
+    move.add_argument("shard", type=int)
+    move.add_argument("--grace-period", type=float, default=2.0, help="Seconds to let in-flight writes finish (default: 2)")
+    commands.add_parser("tenants", help="List tenants and their shards (needs --catalog)")
+    archiving = commands.add_parser("archive", help="Move old answers to compressed archive files, then reclaim "
+                                    "space and refresh statistics (safe while the app is running)")
+    archiving.add_argument("--older-than-days", type=int, default=180, help="Retention window (default: 180)")
+    archiving.add_argument("--batch-size", type=int, default=5000, help="Answers per write transaction (default: 5000)")
+    archiving.add_argument("--full-vacuum", action="store_true",
+                           help="Also VACUUM once to enable incremental vacuum; blocks writers while it runs")
+
+    args = parser.parse_args()
+    db = ShardedUserDatabase(args.catalog, args.db) if args.catalog else UserDatabase(args.db)
+    {
+        "rebuild-aggregates": rebuild_aggregates,
+        "migrate": migrate,
+        "check-query-plans": check_query_plans,
+        "expire-sessions": expire_sessions,
+        "add-shard": add_shard,
+        "add-tenant": add_tenant,
+        "move-tenant": move_tenant,
+        "tenants": list_tenants,
+        "archive": archive_answers,
+    }[args.command](db, args)
+
+
+if __name__ == "__main__":
+    main()
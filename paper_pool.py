@@ -0,0 +1,150 @@
+import threading
+import time
+from array import array
+from collections import deque
+
+from instrumentation import logger
+from utilities import EXAM_TYPES
+
+
+class PaperPool:
+    """Keeps a ready supply of pre-sampled exam papers for each question type.
+
+    A paper is just an array of question ids; question rows are looked up
+    from the shared question cache when they are displayed. Starting an exam
+    takes the first paper in a deque that suits the student, and a background
+    thread tops each deque back up to `target` once it drops below `low_water`.
+    """
+
+    def __init__(self, db, exam_types=EXAM_TYPES, paper_size=10, target=32, low_water=8):
+        self.db = db
+        self.paper_size = paper_size
+        self.target = target
+        self.low_water = low_water
+
+        self._papers = {exam_type: deque() for exam_type in exam_types}
+        # Types that had nothing to sample; skipped until someone asks for them again
+        self._empty = set()
+        self._generation = db.question_index.generation
+        self._wakeup = threading.Condition()
+        self._lock = threading.Lock()
+
+        self.papers_generated = 0
+        self.refill_time = 0.0
+        self.starts = 0
+        self.pool_misses = 0
+        self._start_latencies = deque(maxlen=1000)
+
+        self._thread = threading.Thread(target=self._run, name="paper-pool", daemon=True)
+        self._thread.start()
+
+    def _new_paper(self, exam_type, exclude=(), seen=(), review=()):
+        return array("q", self.db.sample_question_ids(exam_type, self.paper_size, exclude, seen, review))
+
+    def _check_generation(self):
+        # Questions were re-imported or edited: drop papers built from the old index
+        generation = self.db.question_index.generation
+        if generation != self._generation:
+            self._generation = generation
+            for papers in self._papers.values():
+                papers.clear()
+
+    def _needs_refill(self):
+        return [exam_type for exam_type, papers in list(self._papers.items())
+                if len(papers) < self.low_water and exam_type not in self._empty]
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                self._wakeup.wait_for(self._needs_refill)
+            self._check_generation()
+            for exam_type in self._needs_refill():
+                papers = self._papers[exam_type]
+                start = time.perf_counter()
+                generated = 0
+                try:
+                    while len(papers) < self.target:
+                        paper = self._new_paper(exam_type)
+                        if not paper:
+                            break
+                        papers.append(paper)
+                        generated += 1
+                except Exception as e:
+                    logger.warning("Paper pool refill failed for %s: %s", exam_type, e)
+                with self._lock:
+                    self.papers_generated += generated
+                    self.refill_time += time.perf_counter() - start
+                if not generated:
+                    self._empty.add(exam_type)
+
+    def take(self, exam_type, exclude=(), seen=(), review=()):
+        """Returns the question ids for a new exam, avoiding `exclude` where possible.
+
+        `seen` and `review` are the student's history (UserDatabase.get_question_history);
+        a pooled paper is only used if it has nothing they've seen and nothing is due for
+        review. Otherwise a paper is sampled for them, which counts as a pool miss.
+        """
+        start = time.perf_counter()
+        self._check_generation()
+        papers = self._papers.setdefault(exam_type, deque())
+        self._empty.discard(exam_type)
+        exclude = set(exclude)
+        paper = None
+        if not review:
+            # The first pooled paper with nothing this student was already served; papers
+            # that don't suit them stay in the pool for the next student
+            for candidate in list(papers):
+                if any(question_id in exclude or question_id in seen for question_id in candidate):
+                    continue
+                try:
+                    papers.remove(candidate)
+                except ValueError:
+                    # Taken by another start meanwhile
+                    continue
+                paper = candidate
+                break
+        missed = paper is None
+        if missed:
+            paper = self._new_paper(exam_type, exclude, seen, review)
+
+        with self._wakeup:
+            self._wakeup.notify()
+        with self._lock:
+            self.starts += 1
+            self.pool_misses += missed
+            self._start_latencies.append(time.perf_counter() - start)
+        return paper
+
+    def hydrate(self, paper):
+        return self.db.get_questions(paper)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._start_latencies)
+
+            def percentile(p):
+                return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] if latencies else 0.0
+
+            return {
+                "depth": {exam_type: len(papers) for exam_type, papers in self._papers.items()},
+                "papers_generated": self.papers_generated,
+                "refill_rate": self.papers_generated / self.refill_time if self.refill_time else 0.0,
+                "starts": self.starts,
+                "pool_misses": self.pool_misses,
+                "start_latency_p50": percentile(50),
+                "start_latency_p95": percentile(95),
+                "start_latency_p99": percentile(99),
+            }
+
+
+_paper_pools = {}
+_paper_pools_lock = threading.Lock()
+
+
+def get_paper_pool(db, **kwargs):
+    # One pool (and refill thread) per database, shared by every session
+    with _paper_pools_lock:
+        pool = _paper_pools.get(db.db_name)
+        if pool is None:
+            pool = _paper_pools[db.db_name] = PaperPool(db, **kwargs)
+        return pool
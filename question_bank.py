@@ -0,0 +1,184 @@
+"""Bulk import and export of the question bank.
+
+    python question_bank.py import questions.csv
+    python question_bank.py import questions.jsonl --batch-size 100000
+    python question_bank.py export backup.jsonl
+
+Files are streamed row by row and written in large batched transactions, so
+memory use does not depend on file size. Rows are CSV columns or JSON keys:
+question_text, option_a, option_b, option_c, option_d, correct_answer,
+question_type.
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+
+from utilities import EXAM_TYPES, UserDatabase, question_text_hash
+
+FIELDS = ["question_text", "option_a", "option_b", "option_c", "option_d", "correct_answer", "question_type"]
+
+# Accept exam types regardless of case/spacing, but store the app's spelling
+KNOWN_TYPES = {exam_type.strip().upper(): exam_type for exam_type in EXAM_TYPES}
+
+INSERT_QUESTION = """
+    INSERT INTO Questions (question_text, option_a, option_b, option_c, option_d, correct_answer, question_type, text_hash)
+    SELECT ?, ?, ?, ?, ?, ?, ?, ?
+    WHERE NOT EXISTS (SELECT 1 FROM Questions WHERE text_hash = ?)
+"""
+
+
+def _file_format(path, fmt):
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".json")) else "csv"
+
+
+def read_rows(path, fmt):
+    # Yields (row, error) pairs without loading the whole file
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                yield row, None
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line), None
+                except json.JSONDecodeError as e:
+                    yield None, f"invalid JSON ({e.msg})"
+
+
+def validate(row):
+    # Returns the row as a tuple in FIELDS order, or raises ValueError
+    if not isinstance(row, dict):
+        raise ValueError("row is not an object")
+    values = {}
+    for field in FIELDS:
+        value = row.get(field)
+        value = "" if value is None else str(value).strip()
+        if not value:
+            raise ValueError(f"missing {field}")
+        values[field] = value
+
+    values["correct_answer"] = values["correct_answer"].upper()
+    if values["correct_answer"] not in ("A", "B", "C", "D"):
+        raise ValueError(f"correct_answer must be A-D, got {row.get('correct_answer')!r}")
+
+    exam_type = KNOWN_TYPES.get(values["question_type"].upper())
+    if exam_type is None:
+        raise ValueError(f"unknown question_type {row.get('question_type')!r}")
+    values["question_type"] = exam_type
+
+    return tuple(values[field] for field in FIELDS)
+
+
+def import_questions(db, path, fmt=None, batch_size=50_000, max_errors=20, progress=sys.stderr):
+    fmt = _file_format(path, fmt)
+    counts = {"read": 0, "inserted": 0, "duplicates": 0, "invalid": 0}
+    start = time.perf_counter()
+
+    def flush(batch):
+        conn = db._get_connection()
+        try:
+            before = conn.total_changes
+            conn.executemany(INSERT_QUESTION, batch)
+            conn.commit()
+            inserted = conn.total_changes - before
+        finally:
+            db._release_connection(conn)
+        counts["inserted"] += inserted
+        counts["duplicates"] += len(batch) - inserted
+        elapsed = time.perf_counter() - start
+        print(f"{counts['read']:,} rows read, {counts['inserted']:,} inserted "
+              f"({counts['read'] / elapsed:,.0f} rows/s)", file=progress)
+
+    batch = []
+    try:
+        for row_number, (row, error) in enumerate(read_rows(path, fmt), start=1):
+            counts["read"] += 1
+            try:
+                if error:
+                    raise ValueError(error)
+                values = validate(row)
+            except ValueError as e:
+                counts["invalid"] += 1
+                if counts["invalid"] <= max_errors:
+                    print(f"row {row_number}: {e}", file=progress)
+                continue
+
+            text_hash = question_text_hash(values[0])
+            batch.append(values + (text_hash, text_hash))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        db.invalidate_questions()
+
+    counts["seconds"] = time.perf_counter() - start
+    return counts
+
+
+def export_questions(db, path, fmt=None, question_type=None):
+    fmt = _file_format(path, fmt)
+    query = f"SELECT {', '.join(FIELDS)} FROM Questions"
+    params = ()
+    if question_type:
+        query += " WHERE question_type = ?"
+        params = (question_type,)
+    query += " ORDER BY question_id"
+
+    count = 0
+    conn = db._get_connection()
+    try:
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f) if fmt == "csv" else None
+            if writer:
+                writer.writerow(FIELDS)
+            for row in conn.execute(query, params):
+                if writer:
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + "\n")
+                count += 1
+    finally:
+        db._release_connection(conn)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import or export the question bank.")
+    parser.add_argument("--db", default="beta.db", help="Path to the SQLite database (default: beta.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="Load questions from a CSV or JSONL file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension")
+    import_parser.add_argument("--batch-size", type=int, default=50_000, help="Rows per transaction")
+
+    export_parser = commands.add_parser("export", help="Write the question bank to a CSV or JSONL file")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension")
+    export_parser.add_argument("--type", dest="question_type", help="Only export one question_type")
+
+    args = parser.parse_args()
+    db = UserDatabase(args.db)
+
+    if args.command == "import":
+        counts = import_questions(db, args.path, args.format, args.batch_size)
+        print(f"Imported {counts['inserted']:,} questions ({counts['duplicates']:,} duplicates, "
+              f"{counts['invalid']:,} invalid) in {counts['seconds']:.1f}s.")
+        if counts["invalid"]:
+            sys.exit(1)
+    else:
+        count = export_questions(db, args.path, args.format, args.question_type)
+        print(f"Exported {count:,} questions to {args.path}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import struct
+from array import array
+from bisect import bisect_left
+
+# A container holds the ids sharing their high bits; it is a sorted array of the
+# low 16 bits until that would take more room than a 2**16 bit bitmap
+ARRAY_LIMIT = 4096
+BITMAP_BYTES = 1 << 13
+
+_HEADER = struct.Struct("<I")
+_CONTAINER = struct.Struct("<QBI")
+_ARRAY, _BITMAP = 0, 1
+
+# Spaced repetition (Leitner boxes): a wrongly answered question comes back after
+# REVIEW_INTERVALS_DAYS[0] days, and after each further interval it is answered
+# correctly; once it's right in the last box it leaves the queue
+REVIEW_INTERVALS_DAYS = (1, 3, 7, 21)
+# At most this share of a new paper is made of questions due for review
+REVIEW_SHARE = 0.3
+
+
+class SeenSet:
+    """Compressed set of question ids (roaring-style), stored as a blob per user and question type.
+
+    Membership tests are O(log 4096) at worst, whatever the size of the
+    history, so it can be handed to QuestionIndex.sample() as-is.
+    """
+
+    __slots__ = ("_containers", "_len")
+
+    def __init__(self, question_ids=()):
+        self._containers = {}
+        self._len = 0
+        for question_id in question_ids:
+            self.add(question_id)
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, question_id):
+        container = self._containers.get(question_id >> 16)
+        if container is None:
+            return False
+        low = question_id & 0xFFFF
+        if isinstance(container, bytearray):
+            return bool(container[low >> 3] & (1 << (low & 7)))
+        i = bisect_left(container, low)
+        return i < len(container) and container[i] == low
+
+    def __iter__(self):
+        for high in sorted(self._containers):
+            container = self._containers[high]
+            if isinstance(container, bytearray):
+                lows = (low for low in range(1 << 16) if container[low >> 3] & (1 << (low & 7)))
+            else:
+                lows = container
+            for low in lows:
+                yield high << 16 | low
+
+    def add(self, question_id):
+        """Adds a question id; returns whether it was new."""
+        high, low = question_id >> 16, question_id & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            container = self._containers[high] = array("H")
+        if isinstance(container, bytearray):
+            mask = 1 << (low & 7)
+            if container[low >> 3] & mask:
+                return False
+            container[low >> 3] |= mask
+        else:
+            i = bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                return False
+            container.insert(i, low)
+            if len(container) > ARRAY_LIMIT:
+                self._containers[high] = _to_bitmap(container)
+        self._len += 1
+        return True
+
+    def update(self, question_ids):
+        return sum(self.add(question_id) for question_id in question_ids)
+
+    def to_bytes(self):
+        parts = [_HEADER.pack(len(self._containers))]
+        for high in sorted(self._containers):
+            container = self._containers[high]
+            if isinstance(container, bytearray):
+                count = sum(bin(byte).count("1") for byte in container)
+                parts += [_CONTAINER.pack(high, _BITMAP, count), bytes(container)]
+            else:
+                parts += [_CONTAINER.pack(high, _ARRAY, len(container)), container.tobytes()]
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        seen = cls()
+        if not data:
+            return seen
+        (containers,) = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+        for _ in range(containers):
+            high, kind, count = _CONTAINER.unpack_from(data, offset)
+            offset += _CONTAINER.size
+            if kind == _BITMAP:
+                seen._containers[high] = bytearray(data[offset:offset + BITMAP_BYTES])
+                offset += BITMAP_BYTES
+            else:
+                container = seen._containers[high] = array("H")
+                container.frombytes(data[offset:offset + 2 * count])
+                offset += 2 * count
+            seen._len += count
+        return seen
+
+
+def _to_bitmap(container):
+    bitmap = bytearray(BITMAP_BYTES)
+    for low in container:
+        bitmap[low >> 3] |= 1 << (low & 7)
+    return bitmap
+
+
+def next_review(box, correct):
+    """(box, days until due) after answering a queued question, or None once it has been learned."""
+    if not correct:
+        return 0, REVIEW_INTERVALS_DAYS[0]
+    box += 1
+    if box >= len(REVIEW_INTERVALS_DAYS):
+        return None
+    return box, REVIEW_INTERVALS_DAYS[box]
@@ -0,0 +1,490 @@
+import os
+import sqlite3
+import threading
+import time
+
+from instrumentation import logger
+from utilities import UserDatabase, get_cache, get_pool
+
+# Session ids handed out by ShardedUserDatabase carry their shard in the low bits
+SHARD_BITS = 10
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS Shards (
+    shard_id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS Tenants (
+    tenant TEXT PRIMARY KEY,
+    shard_id INTEGER NOT NULL REFERENCES Shards(shard_id),
+    state TEXT NOT NULL DEFAULT 'active'
+);
+CREATE TABLE IF NOT EXISTS Directory (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    tenant TEXT NOT NULL REFERENCES Tenants(tenant)
+);
+CREATE INDEX IF NOT EXISTS idx_directory_tenant ON Directory (tenant);
+"""
+
+# Tables holding a tenant's data, and the columns not copied when it moves (ids are reassigned)
+USER_TABLES = [
+    ("Users", ()),
+    ("UserProgress", ("progress_id",)),
+    ("UserAnswers", ("answer_id", "session_id")),
+    ("UserTopicStats", ()),
+    ("UserSeenQuestions", ()),
+    ("ReviewQueue", ()),
+    ("UserAnswerSummary", ()),
+]
+
+DEFAULT_TENANT = "default"
+
+
+def create_shard(path, template):
+    """Creates an empty shard file with the same schema and schema version as `template`."""
+    source = sqlite3.connect(template)
+    try:
+        version = source.execute("PRAGMA user_version").fetchone()[0]
+        ddl = [sql for (sql,) in source.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY type = 'index'"
+        )]
+    finally:
+        source.close()
+
+    target = sqlite3.connect(path)
+    try:
+        # Lets `manage.py archive` give freed space back without a full VACUUM
+        target.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        for statement in ddl:
+            target.execute(statement)
+        target.execute(f"PRAGMA user_version = {version}")
+        target.commit()
+    finally:
+        target.close()
+
+
+class ShardedUserDatabase:
+    """UserDatabase interface over one shared question bank and per-tenant shard files.
+
+    A small catalog database maps tenants to shard files and usernames to
+    globally unique user ids. Each shard is an ordinary UserDatabase file
+    (its own pool, cache and write lock) holding the users, progress and
+    answers of the tenants placed on it; questions are only read from the
+    bank. The first shard is the bank file itself, so an existing
+    single-file database becomes a one-shard setup with its users in the
+    "default" tenant.
+
+    Session ids returned here encode their shard, so calls that only get a
+    session id can still be routed. Admin views are answered from the
+    catalog (counts, paging) and then the owning shards.
+    """
+
+    def __init__(self, catalog_path, bank_path="beta.db"):
+        self.db_name = catalog_path
+        self.catalog = get_pool(catalog_path)
+        self.routes = get_cache(catalog_path)
+        self._init_catalog(bank_path)
+        self.bank = UserDatabase(self._setting("bank"))
+        self.pool = self.bank.pool
+        self.question_index = self.bank.question_index
+        self._shards = {}
+        self._shards_lock = threading.Lock()
+
+    def _init_catalog(self, bank_path):
+        with self.catalog.connection() as conn:
+            conn.executescript(CATALOG_SCHEMA)
+            if conn.execute("SELECT 1 FROM Settings WHERE key = 'bank'").fetchone() is not None:
+                return
+            # Adopt the existing database: it stays shard 0 and keeps its users and ids
+            UserDatabase(bank_path)
+            conn.execute("ATTACH DATABASE ? AS bank", (bank_path,))
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                # Another process may have got there first
+                if conn.execute("SELECT 1 FROM Settings WHERE key = 'bank'").fetchone() is None:
+                    conn.execute("INSERT INTO Settings (key, value) VALUES ('bank', ?), ('epoch', '0')", (bank_path,))
+                    conn.execute("INSERT INTO Shards (shard_id, path) VALUES (0, ?)", (bank_path,))
+                    conn.execute("INSERT INTO Tenants (tenant, shard_id) VALUES (?, 0)", (DEFAULT_TENANT,))
+                    conn.execute("INSERT INTO Directory (user_id, username, email, tenant) "
+                                 "SELECT user_id, username, email, ? FROM bank.Users", (DEFAULT_TENANT,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute("DETACH DATABASE bank")
+
+    def _setting(self, key):
+        with self.catalog.connection() as conn:
+            return conn.execute("SELECT value FROM Settings WHERE key = ?", (key,)).fetchone()[0]
+
+    # Routing
+
+    def _shard(self, shard_id):
+        with self._shards_lock:
+            shard = self._shards.get(shard_id)
+            if shard is None:
+                with self.catalog.connection() as conn:
+                    row = conn.execute("SELECT path FROM Shards WHERE shard_id = ?", (shard_id,)).fetchone()
+                if row is None:
+                    raise ValueError(f"Unknown shard {shard_id}.")
+                shard = self._shards[shard_id] = UserDatabase(row[0], bank=self.bank)
+            return shard
+
+    def _tenant_shard(self, tenant, write=False):
+        # Not cached: a tenant move must take effect in every process at once
+        with self.catalog.connection() as conn:
+            row = conn.execute("SELECT shard_id, state FROM Tenants WHERE tenant = ?", (tenant,)).fetchone()
+        if row is None:
+            raise ValueError(f"Unknown tenant {tenant}.")
+        if write and row[1] == "moving":
+            raise sqlite3.OperationalError(f"Tenant {tenant} is being moved to another shard; try again shortly.")
+        return self._shard(row[0])
+
+    def _lookup(self, username):
+        # (user_id, tenant) from the directory; a user never changes either
+        def load():
+            with self.catalog.connection() as conn:
+                return conn.execute("SELECT user_id, tenant FROM Directory WHERE username = ?", (username,)).fetchone()
+        return self.routes.get_or_load(("directory", username), load)
+
+    def _tenant_of(self, user_id):
+        def load():
+            with self.catalog.connection() as conn:
+                row = conn.execute("SELECT tenant FROM Directory WHERE user_id = ?", (user_id,)).fetchone()
+            return row[0] if row else None
+        return self.routes.get_or_load(("tenant", user_id), load)
+
+    def _by_username(self, username, write=False):
+        entry = self._lookup(username)
+        return self._tenant_shard(entry[1], write) if entry else None
+
+    def _by_user_id(self, user_id, write=False):
+        tenant = self._tenant_of(user_id)
+        if tenant is None:
+            raise ValueError("User not found.")
+        return self._tenant_shard(tenant, write)
+
+    def _session(self, session_id):
+        return self._shard(session_id & ((1 << SHARD_BITS) - 1)), session_id >> SHARD_BITS
+
+    def _global_session_id(self, shard, session_id):
+        with self._shards_lock:
+            shard_id = next(shard_id for shard_id, db in self._shards.items() if db is shard)
+        return session_id << SHARD_BITS | shard_id
+
+    # Users
+
+    def authenticate_user(self, username, password):
+        shard = self._by_username(username)
+        return shard.authenticate_user(username, password) if shard else False
+
+    def add_user(self, username, password, email, user_type, tenant=DEFAULT_TENANT):
+        shard = self._tenant_shard(tenant, write=True)
+        with self.catalog.connection() as conn:
+            try:
+                cursor = conn.execute("INSERT INTO Directory (username, email, tenant) VALUES (?, ?, ?)",
+                                      (username, email, tenant))
+                conn.commit()
+            except sqlite3.IntegrityError as e:
+                if "username" in str(e):
+                    raise ValueError("Username already exists.")
+                elif "email" in str(e):
+                    raise ValueError("Email address already exists.")
+                raise ValueError("Database error.")
+        user_id = cursor.lastrowid
+        try:
+            return shard.add_user(username, password, email, user_type, user_id=user_id)
+        except Exception:
+            with self.catalog.connection() as conn:
+                conn.execute("DELETE FROM Directory WHERE user_id = ?", (user_id,))
+                conn.commit()
+            raise
+        finally:
+            self.routes.invalidate(("directory", username))
+
+    def find_user(self, username, email):
+        # (user_id, username, email, tenant): the same leading columns as a Users row
+        with self.catalog.connection() as conn:
+            return conn.execute("SELECT user_id, username, email, tenant FROM Directory WHERE username = ? OR email = ?",
+                                (username, email)).fetchone()
+
+    def is_admin(self, username):
+        shard = self._by_username(username)
+        return shard.is_admin(username) if shard else False
+
+    def appoint_admin(self, username):
+        shard = self._by_username(username, write=True)
+        if shard is None:
+            raise ValueError("User not found.")
+        return shard.appoint_admin(username)
+
+    def remove_admin(self, username):
+        shard = self._by_username(username, write=True)
+        if shard is None:
+            raise ValueError("User not found.")
+        return shard.remove_admin(username)
+
+    def get_user_id(self, username):
+        entry = self._lookup(username)
+        return entry[0] if entry else None
+
+    def get_user_details(self, user_id):
+        return self._by_user_id(user_id).get_user_details(user_id)
+
+    def get_user_progress(self, user_id):
+        return self._by_user_id(user_id).get_user_progress(user_id)
+
+    def get_exam_history(self, user_id, before=None, limit=20, exam_type=None):
+        return self._by_user_id(user_id).get_exam_history(user_id, before, limit, exam_type)
+
+    def get_topic_stats(self, user_id):
+        return self._by_user_id(user_id).get_topic_stats(user_id)
+
+    def get_question_history(self, user_id, exam_type, max_reviews=50):
+        return self._by_user_id(user_id).get_question_history(user_id, exam_type, max_reviews)
+
+    # Admin views, across shards
+
+    def count_users(self):
+        with self.catalog.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM Directory").fetchone()[0]
+
+    def get_users_page(self, page=0, page_size=50):
+        with self.catalog.connection() as conn:
+            rows = conn.execute("SELECT user_id, tenant FROM Directory ORDER BY user_id LIMIT ? OFFSET ?",
+                                (page_size, page * page_size)).fetchall()
+        return self._get_users(rows)
+
+    def get_all_users(self):
+        with self.catalog.connection() as conn:
+            rows = conn.execute("SELECT user_id, tenant FROM Directory ORDER BY user_id").fetchall()
+        return self._get_users(rows)
+
+    def _get_users(self, rows):
+        by_tenant = {}
+        for user_id, tenant in rows:
+            by_tenant.setdefault(tenant, []).append(user_id)
+        users = []
+        for tenant, user_ids in by_tenant.items():
+            shard = self._tenant_shard(tenant)
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(user_ids), 500):
+                users.extend(shard.get_users(user_ids[start:start + 500]))
+        return sorted(users)
+
+    # Questions: always the shared bank
+
+    def get_questions(self, question_ids):
+        return self.bank.get_questions(question_ids)
+
+    def sample_question_ids(self, exam_type, num_questions=10, exclude=(), seen=(), review=()):
+        return self.bank.sample_question_ids(exam_type, num_questions, exclude, seen, review)
+
+    def get_random_questions(self, exam_type, num_questions=10, exclude=()):
+        return self.bank.get_random_questions(exam_type, num_questions, exclude)
+
+    def invalidate_questions(self):
+        self.bank.invalidate_questions()
+
+    def _get_connection(self):
+        # Question reads (analytics, item bank); answers are read per shard via shards()
+        return self.bank._get_connection()
+
+    def _release_connection(self, conn):
+        self.bank._release_connection(conn)
+
+    # Exams
+
+    def start_exam_session(self, user_id, exam_type, question_ids, adaptive=False):
+        shard = self._by_user_id(user_id, write=True)
+        return self._global_session_id(shard, shard.start_exam_session(user_id, exam_type, question_ids, adaptive))
+
+    def record_answer(self, session_id, user_id, question_id, selected_answer, is_correct):
+        shard, local_id = self._session(session_id)
+        if shard is not self._by_user_id(user_id, write=True):
+            # Moving the tenant closed its open exams on the old shard
+            raise ValueError("This exam was closed while your data was moved; please start a new exam.")
+        return shard.record_answer(local_id, user_id, question_id, selected_answer, is_correct)
+
+    def get_active_exam_session(self, user_id):
+        shard = self._by_user_id(user_id)
+        session = shard.get_active_exam_session(user_id)
+        if session is None:
+            return None
+        return (self._global_session_id(shard, session[0]),) + tuple(session[1:])
+
+    def finish_exam_session(self, session_id):
+        shard, local_id = self._session(session_id)
+        return shard.finish_exam_session(local_id)
+
+    def save_exam_results_backend(self, user_id, user_answers):
+        return self._by_user_id(user_id, write=True).save_exam_results_backend(user_id, user_answers)
+
+    def expire_exam_sessions(self, max_idle_seconds=3600):
+        finished = expired = 0
+        for shard in self.shards():
+            shard_finished, shard_expired = shard.expire_exam_sessions(max_idle_seconds)
+            finished += shard_finished
+            expired += shard_expired
+        return finished, expired
+
+    # Maintenance and stats
+
+    def shards(self):
+        with self.catalog.connection() as conn:
+            shard_ids = [row[0] for row in conn.execute("SELECT shard_id FROM Shards ORDER BY shard_id")]
+        return [self._shard(shard_id) for shard_id in shard_ids]
+
+    def warm_up(self, connections=None):
+        # Shard 0 is the bank, so this also loads the question index
+        self.catalog.warm_up(connections)
+        for shard in self.shards():
+            shard.warm_up(connections)
+
+    def epoch(self):
+        return int(self._setting("epoch"))
+
+    def rebuild_user_aggregates(self):
+        return sum(shard.rebuild_user_aggregates() for shard in self.shards())
+
+    def schema_version(self):
+        return min(shard.schema_version() for shard in self.shards())
+
+    def pool_stats(self):
+        return {os.path.basename(shard.db_name): shard.pool_stats() for shard in self.shards()}
+
+    def cache_stats(self):
+        return {os.path.basename(shard.db_name): shard.cache_stats() for shard in self.shards()}
+
+    def result_writer_stats(self):
+        return None
+
+    # Placement
+
+    def add_shard(self, path):
+        """Registers a shard file, creating it from the bank's schema if needed; returns its id."""
+        if not os.path.exists(path):
+            create_shard(path, self.bank.db_name)
+        with self.catalog.connection() as conn:
+            cursor = conn.execute("INSERT INTO Shards (path) VALUES (?)", (path,))
+            conn.commit()
+            return cursor.lastrowid
+
+    def add_tenant(self, tenant, shard_id=None):
+        """Places a new tenant on `shard_id`, or on the shard with the fewest users."""
+        with self.catalog.connection() as conn:
+            if shard_id is None:
+                shard_id = conn.execute("""
+                    SELECT s.shard_id FROM Shards AS s
+                    LEFT JOIN Tenants AS t ON t.shard_id = s.shard_id
+                    LEFT JOIN Directory AS d ON d.tenant = t.tenant
+                    GROUP BY s.shard_id ORDER BY COUNT(d.user_id), s.shard_id LIMIT 1
+                """).fetchone()[0]
+            conn.execute("INSERT INTO Tenants (tenant, shard_id) VALUES (?, ?)", (tenant, shard_id))
+            conn.commit()
+        return shard_id
+
+    def list_tenants(self):
+        # (tenant, shard_id, shard path, state, users)
+        with self.catalog.connection() as conn:
+            return conn.execute("""
+                SELECT t.tenant, t.shard_id, s.path, t.state, COUNT(d.user_id)
+                FROM Tenants AS t JOIN Shards AS s ON s.shard_id = t.shard_id
+                LEFT JOIN Directory AS d ON d.tenant = t.tenant
+                GROUP BY t.tenant ORDER BY t.tenant
+            """).fetchall()
+
+    def _set_tenant(self, tenant, **values):
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        with self.catalog.connection() as conn:
+            conn.execute(f"UPDATE Tenants SET {assignments} WHERE tenant = ?", (*values.values(), tenant))
+            conn.commit()
+
+    def move_tenant(self, tenant, shard_id, grace_period=2.0):
+        """Moves a tenant's users, progress and answers to another shard; returns the users moved.
+
+        Writes for the tenant are refused while it moves: the tenant is marked
+        'moving', in-flight calls get `grace_period` seconds to finish, and
+        its open exam sessions are finished. Rows are then copied (new
+        progress/answer ids, same user ids), the catalog is switched and the
+        source rows deleted. Every step can be re-run, so an interrupted move
+        is completed by moving again.
+        """
+        source = self._tenant_shard(tenant)
+        target = self._shard(shard_id)
+        self._set_tenant(tenant, state="moving")
+        try:
+            time.sleep(grace_period)
+            with self.catalog.connection() as conn:
+                user_ids = [row[0] for row in conn.execute("SELECT user_id FROM Directory WHERE tenant = ?", (tenant,))]
+            if source is not target:
+                self._copy_users(source, target, user_ids)
+            self._set_tenant(tenant, shard_id=shard_id, state="active")
+            with self.catalog.connection() as conn:
+                conn.execute("UPDATE Settings SET value = value + 1 WHERE key = 'epoch'")
+                conn.commit()
+        except Exception:
+            self._set_tenant(tenant, state="active")
+            raise
+        # Leftovers on any other shard, e.g. from an earlier interrupted move
+        for shard in self.shards():
+            if shard is not target:
+                self._delete_users(shard, user_ids)
+        logger.info("Moved tenant %s (%d users) to shard %d", tenant, len(user_ids), shard_id)
+        return len(user_ids)
+
+    def _copy_users(self, source, target, user_ids):
+        conn = source._get_connection()
+        try:
+            conn.execute("CREATE TEMP TABLE moving_users (user_id INTEGER PRIMARY KEY)")
+            conn.executemany("INSERT INTO moving_users VALUES (?)", [(user_id,) for user_id in user_ids])
+            conn.commit()
+            # Open exams are closed with the answers they have, as the expiry job would
+            active = conn.execute(
+                "SELECT session_id FROM ExamSessions WHERE status = 'active' "
+                "AND user_id IN (SELECT user_id FROM moving_users)"
+            ).fetchall()
+            for (session_id,) in active:
+                source.finish_exam_session(session_id)
+            conn.execute("ATTACH DATABASE ? AS target", (target.db_name,))
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for table, skipped in reversed(USER_TABLES):
+                    conn.execute(f"DELETE FROM target.{table} WHERE user_id IN (SELECT user_id FROM moving_users)")
+                for table, skipped in USER_TABLES:
+                    target_columns = {row[1] for row in conn.execute(f"PRAGMA target.table_info({table})")}
+                    columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")
+                                        if row[1] not in skipped and row[1] in target_columns)
+                    conn.execute(f"INSERT INTO target.{table} ({columns}) SELECT {columns} FROM main.{table} "
+                                 "WHERE user_id IN (SELECT user_id FROM moving_users)")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute("DETACH DATABASE target")
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.moving_users")
+            source._release_connection(conn)
+
+    def _delete_users(self, shard, user_ids):
+        conn = shard._get_connection()
+        try:
+            for start in range(0, len(user_ids), 500):
+                batch = user_ids[start:start + 500]
+                placeholders = ", ".join("?" * len(batch))
+                for table in ("UserAnswers", "UserProgress", "UserTopicStats", "UserSeenQuestions", "ReviewQueue",
+                              "UserAnswerSummary", "ExamSessions", "Users"):
+                    conn.execute(f"DELETE FROM {table} WHERE user_id IN ({placeholders})", batch)
+            conn.commit()
+        finally:
+            shard._release_connection(conn)
+        shard.cache.clear()
@@ -1,12 +1,894 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import random
 import sqlite3
-import bcrypt
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
 
+from instrumentation import instrument_methods, logger
+from seen_questions import REVIEW_SHARE, SeenSet, next_review
+
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived SQLite connections for one database file.
+
+    A thread that already holds a connection gets the same one back, so nested
+    calls (e.g. a method that looks up a user id) don't take a second slot.
+    """
+
+    def __init__(self, db_name, max_size=8, timeout=30.0, busy_timeout_ms=5000, cached_statements=256):
+        self.db_name = db_name
+        self.max_size = max_size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._created = 0
+
+        # Counters used to size the pool
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        return conn
+
+    def acquire(self):
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            self._local.depth += 1
+            with self._lock:
+                self.hits += 1
+            return held
+
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.max_size
+                if can_create:
+                    self._created += 1
+                    self.misses += 1
+            if can_create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                start = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError("Timed out waiting for a database connection.")
+                with self._lock:
+                    self.waits += 1
+                    self.wait_time += time.perf_counter() - start
+
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def release(self, conn):
+        if getattr(self._local, "conn", None) is not conn:
+            return
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        self._local.conn = None
+        # Never hand a half-finished transaction to the next caller
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def warm_up(self, count=None):
+        """Opens up to `count` (default: max_size) connections ahead of demand; returns how many."""
+        with self._lock:
+            opened = max(0, min(count or self.max_size, self.max_size) - self._created)
+            self._created += opened
+        for i in range(opened):
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= opened - i
+                raise
+            self._idle.put(conn)
+        return opened
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self._created,
+                "idle": self._idle.qsize(),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name, **kwargs):
+    # One pool per database file, shared by every UserDatabase in the process
+    with _pools_lock:
+        pool = _pools.get(db_name)
+        if pool is None:
+            pool = _pools[db_name] = ConnectionPool(db_name, **kwargs)
+        return pool
+
+
+class QuestionIndex:
+    """Per question_type arrays of question ids, kept in memory for O(k) sampling.
+
+    The index is rebuilt when a question with a higher id than the last one
+    seen shows up, or when refresh() is called after questions are changed.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._max_id = None
+        self._lock = threading.Lock()
+        # Bumped whenever the index is dropped, so holders of sampled ids can tell they are stale
+        self.generation = 0
+
+    def refresh(self):
+        with self._lock:
+            self._ids = {}
+            self._max_id = None
+            self.generation += 1
+
+    def _load(self, conn):
+        max_id = conn.execute("SELECT MAX(question_id) FROM Questions").fetchone()[0]
+        with self._lock:
+            if self._max_id is not None and max_id == self._max_id:
+                return self._ids
+
+        # In id order, so question_type() can bisect
+        ids = {}
+        for question_type, question_id in conn.execute(
+                "SELECT question_type, question_id FROM Questions ORDER BY question_id"):
+            ids.setdefault(question_type, array("q")).append(question_id)
+
+        with self._lock:
+            self._ids = ids
+            self._max_id = max_id
+            return ids
+
+    def ids(self, conn, exam_type):
+        return self._load(conn).get(exam_type, array("q"))
+
+    def question_type(self, conn, question_id):
+        # None for ids not in the bank
+        for exam_type, ids in self._load(conn).items():
+            i = bisect_left(ids, question_id)
+            if i < len(ids) and ids[i] == question_id:
+                return exam_type
+        return None
+
+    def types(self, conn):
+        # (question_id, question_type) for every question
+        return [(question_id, exam_type) for exam_type, ids in self._load(conn).items() for question_id in ids]
+
+    def sample(self, conn, exam_type, k, exclude=(), seen=(), reserved=()):
+        """k random ids of exam_type, avoiding `exclude`, and preferring ids not in `seen`.
+
+        `seen` (e.g. a SeenSet) is only tested for membership, never copied,
+        so a long answer history doesn't make sampling slower. `reserved` ids
+        are never returned, even when the bank runs out and `exclude` is
+        reused (e.g. ones the caller adds to the paper itself).
+        """
+        ids = self.ids(conn, exam_type)
+        exclude = set(exclude)
+        reserved = set(reserved)
+        available = len(ids) - len(exclude | reserved) - len(seen)
+
+        # Nearly all of the bank already used or seen: fall back to filtering the ids. Above
+        # that, random draws need about k * len(ids) / available tries, at most 16k.
+        if available <= max(2 * k, len(ids) // 16):
+            fresh, repeats, used = [], [], []
+            for question_id in ids:
+                if question_id in reserved:
+                    continue
+                if question_id in exclude:
+                    used.append(question_id)
+                elif question_id in seen:
+                    repeats.append(question_id)
+                else:
+                    fresh.append(question_id)
+            picked = random.sample(fresh, min(k, len(fresh)))
+            # Not enough new questions left: top up with ones seen in earlier exams, then this session's
+            for pool in (repeats, used):
+                picked += random.sample(pool, min(k - len(picked), len(pool)))
+            return picked
+
+        # Otherwise draw random positions, retrying on duplicates/excluded/seen ids
+        picked = []
+        drawn = set()
+        while len(picked) < k:
+            question_id = ids[random.randrange(len(ids))]
+            if question_id in exclude or question_id in reserved or question_id in drawn or question_id in seen:
+                continue
+            drawn.add(question_id)
+            picked.append(question_id)
+        return picked
+
+
+_question_indexes = {}
+
+
+def get_question_index(db_name):
+    with _pools_lock:
+        index = _question_indexes.get(db_name)
+        if index is None:
+            index = _question_indexes[db_name] = QuestionIndex()
+        return index
+
+
+_MISSING = object()
+
+
+def _approximate_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list, set, frozenset)):
+        size += sum(_approximate_size(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(_approximate_size(k) + _approximate_size(v) for k, v in value.items())
+    return size
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a TTL.
+
+    Keys are tuples whose first item names the kind of entry ("role",
+    "user_id", "question"), so a whole kind can be dropped at once.
+    """
+
+    def __init__(self, max_entries=50_000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (expires_at, value, approximate size in bytes)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        # Sized outside the lock, so stats() never has to walk the entries
+        size = _approximate_size(key) + _approximate_size(value)
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (expires_at, value, size)
+            self._memory_bytes += size
+            while len(self._data) > self.max_entries:
+                self._memory_bytes -= self._data.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def _remove(self, key):
+        # Caller holds the lock
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry[2]
+
+    def get_or_load(self, key, loader, ttl=None):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_prefix(self, kind):
+        with self._lock:
+            for key in [key for key in self._data if key[0] == kind]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._memory_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_bytes": self._memory_bytes,
+            }
+
+
+_caches = {}
+
+
+def get_cache(db_name):
+    # Shared by every session served by this process
+    with _pools_lock:
+        cache = _caches.get(db_name)
+        if cache is None:
+            cache = _caches[db_name] = TTLCache()
+        return cache
+
+
+class ResultWriter:
+    """Write-behind queue for exam results.
+
+    Submissions are queued and a single writer thread commits them in groups,
+    so a burst of submits takes the SQLite write lock a handful of times
+    instead of once per student. submit() returns a Future that resolves once
+    the group holding that submission has been committed.
+    """
+
+    def __init__(self, pool, write, max_batch=128):
+        self.pool = pool
+        self.write = write
+        self.max_batch = max_batch
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.flushed = 0
+        self.flush_time = 0.0
+        self.last_flush_time = 0.0
+        self.max_flush_time = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, user_answers):
+        future = Future()
+        self._queue.put((user_id, list(user_answers), future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                for user_id, user_answers, _ in batch:
+                    self.write(cursor, user_id, user_answers)
+                conn.commit()
+        except Exception as e:
+            if len(batch) > 1:
+                # Retry one by one so a single bad submission doesn't fail the group
+                for item in batch:
+                    self._flush([item])
+                return
+            batch[0][2].set_exception(e)
+            return
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.flushes += 1
+            self.flushed += len(batch)
+            self.flush_time += elapsed
+            self.last_flush_time = elapsed
+            self.max_flush_time = max(self.max_flush_time, elapsed)
+        for _, _, future in batch:
+            future.set_result(None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "flushes": self.flushes,
+                "flushed": self.flushed,
+                "avg_batch": self.flushed / self.flushes if self.flushes else 0,
+                "avg_flush_time": self.flush_time / self.flushes if self.flushes else 0.0,
+                "last_flush_time": self.last_flush_time,
+                "max_flush_time": self.max_flush_time,
+            }
+
+
+_result_writers = {}
+
+
+def get_result_writer(db_name, pool, write):
+    # One writer thread per database file
+    with _pools_lock:
+        writer = _result_writers.get(db_name)
+        if writer is None:
+            writer = _result_writers[db_name] = ResultWriter(pool, write)
+        return writer
+
+
+# Exam types offered in the app; stored values keep their original spelling
+EXAM_TYPES = ["VERBAL ABILITY", " ANALYTICAL REASONING", "QUANTITATIVE REASONING", "SUBJECT KNOWLEDGE"]
+
+
+def normalize_question_text(text):
+    return " ".join(text.casefold().split())
+
+
+def question_text_hash(text):
+    # Stable signed 64-bit hash of the normalized text, used to spot duplicate questions
+    digest = hashlib.blake2b(normalize_question_text(text).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+# bcrypt work factor for new and upgraded password hashes
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+
+
+def _hash_password(password, rounds):
+    # Imported here: only the hashing worker processes need bcrypt
+    import bcrypt
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _check_password(password, hashed_password):
+    import bcrypt
+    return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+
+def _load_bcrypt():
+    import bcrypt  # noqa: F401
+
+
+_hash_executor = None
+_hash_slots = None
+
+
+def _get_hash_executor():
+    # Created on first use; spawned workers avoid forking the threaded server process
+    global _hash_executor, _hash_slots
+    with _pools_lock:
+        if _hash_executor is None:
+            workers = int(os.environ.get("BCRYPT_WORKERS", os.cpu_count() or 1))
+            _hash_executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            # Bound the backlog so a login burst waits here instead of queueing without limit
+            _hash_slots = threading.BoundedSemaphore(workers * 4)
+        return _hash_executor, _hash_slots
+
+
+class PasswordHasher:
+    """bcrypt hashing and checking on a shared pool of worker processes.
+
+    bcrypt is CPU bound, so running it on the Streamlit script thread
+    serializes logins; the process pool spreads them across cores.
+    """
+
+    def __init__(self, rounds=BCRYPT_ROUNDS):
+        self.rounds = rounds
+
+    def _run(self, func, *args):
+        executor, slots = _get_hash_executor()
+        with slots:
+            return executor.submit(func, *args).result()
+
+    def warm_up(self):
+        # Starts the worker processes, and their imports, before the first login waits on them
+        self._run(_load_bcrypt)
+
+    def hash(self, password):
+        return self._run(_hash_password, password, self.rounds)
+
+    def check(self, password, hashed_password):
+        return self._run(_check_password, password, hashed_password)
+
+    def needs_rehash(self, hashed_password):
+        # bcrypt hashes look like $2b$<cost>$<salt+hash>
+        try:
+            return int(hashed_password.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+def _rebuild_user_aggregates(cursor):
+    cursor.execute("""
+        UPDATE Users SET
+            total_attempted = IFNULL(p.total_attempted, 0),
+            total_correct = IFNULL(p.total_correct, 0),
+            total_score = IFNULL(p.total_score, 0),
+            attempt_count = IFNULL(p.attempt_count, 0),
+            last_attempt_at = p.last_attempt_at
+        FROM (
+            SELECT
+                user_id,
+                SUM(questions_attempted) AS total_attempted,
+                SUM(correct_answers) AS total_correct,
+                SUM(score) AS total_score,
+                COUNT(*) AS attempt_count,
+                MAX(completed_at) AS last_attempt_at
+            FROM UserProgress
+            GROUP BY user_id
+        ) AS p
+        WHERE Users.user_id = p.user_id;
+    """)
+    updated = cursor.rowcount
+    # Users without any history
+    cursor.execute("""
+        UPDATE Users SET total_attempted = 0, total_correct = 0, total_score = 0,
+            attempt_count = 0, last_attempt_at = NULL
+        WHERE user_id NOT IN (SELECT user_id FROM UserProgress WHERE user_id IS NOT NULL);
+    """)
+    return updated
+
+
+def _fill_question_types(conn, types):
+    # temp.QuestionTypes (question_id -> question_type), for the statements below that need
+    # the type of answered questions: the bank holding them may be another file (UserDatabase.bank)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS QuestionTypes "
+                 "(question_id INTEGER PRIMARY KEY, question_type TEXT NOT NULL)")
+    conn.execute("DELETE FROM temp.QuestionTypes")
+    conn.executemany("INSERT INTO temp.QuestionTypes (question_id, question_type) VALUES (?, ?)", types)
+    conn.commit()
+
+
+def _rebuild_topic_stats(cursor):
+    # Per-type totals from the saved and archived answers, leaving out unfinished exams (they are added
+    # when they finish); when each type was last taken isn't recoverable
+    cursor.execute("DELETE FROM UserTopicStats")
+    cursor.execute("""
+        INSERT INTO UserTopicStats (user_id, question_type, questions_attempted, correct_answers)
+        SELECT user_id, question_type, SUM(attempts), SUM(correct)
+        FROM (
+            SELECT a.user_id, q.question_type, COUNT(*) AS attempts, IFNULL(SUM(a.is_correct), 0) AS correct
+            FROM UserAnswers AS a JOIN temp.QuestionTypes AS q ON q.question_id = a.question_id
+            WHERE a.user_id IS NOT NULL AND (a.session_id IS NULL OR a.session_id NOT IN
+                (SELECT session_id FROM ExamSessions WHERE status = 'active'))
+            GROUP BY a.user_id, q.question_type
+            UNION ALL
+            SELECT user_id, question_type, attempts, correct FROM UserAnswerSummary
+        )
+        GROUP BY user_id, question_type
+    """)
+
+
+def _add_user_aggregate_columns(cursor):
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(Users)")}
+    for name, ddl in [
+        ("attempt_count", "INTEGER DEFAULT 0"),
+        ("total_score", "INTEGER DEFAULT 0"),
+        ("last_attempt_at", "DATETIME"),
+    ]:
+        if name not in columns:
+            cursor.execute(f"ALTER TABLE Users ADD COLUMN {name} {ddl}")
+    _rebuild_user_aggregates(cursor)
+
+
+def _add_question_text_hash(cursor):
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(Questions)")}
+    if "text_hash" not in columns:
+        cursor.execute("ALTER TABLE Questions ADD COLUMN text_hash INTEGER")
+    cursor.connection.create_function("question_text_hash", 1, question_text_hash, deterministic=True)
+    cursor.execute("UPDATE Questions SET text_hash = question_text_hash(question_text) WHERE text_hash IS NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_questions_text_hash ON Questions (text_hash)")
+
+
+def _add_exam_history(cursor):
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(UserProgress)")}
+    if "exam_type" not in columns:
+        # Older attempts didn't record it and stay NULL
+        cursor.execute("ALTER TABLE UserProgress ADD COLUMN exam_type TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_userprogress_user_type_completed "
+                   "ON UserProgress (user_id, exam_type, completed_at)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS UserTopicStats (
+            user_id INTEGER NOT NULL,
+            question_type TEXT NOT NULL,
+            questions_attempted INTEGER NOT NULL DEFAULT 0,
+            correct_answers INTEGER NOT NULL DEFAULT 0,
+            last_attempt_at DATETIME,
+            PRIMARY KEY (user_id, question_type),
+            FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """)
+    # Per-type totals for the answers saved so far; those of unfinished exams are added when they finish
+    cursor.execute("""
+        INSERT OR REPLACE INTO UserTopicStats (user_id, question_type, questions_attempted, correct_answers)
+        SELECT a.user_id, q.question_type, COUNT(*), IFNULL(SUM(a.is_correct), 0)
+        FROM UserAnswers AS a JOIN temp.QuestionTypes AS q ON q.question_id = a.question_id
+        WHERE a.user_id IS NOT NULL AND (a.session_id IS NULL OR a.session_id NOT IN
+            (SELECT session_id FROM ExamSessions WHERE status = 'active'))
+        GROUP BY a.user_id, q.question_type
+    """)
+
+
+def _add_question_history(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS UserSeenQuestions (
+            user_id INTEGER NOT NULL,
+            question_type TEXT NOT NULL,
+            seen BLOB NOT NULL,
+            PRIMARY KEY (user_id, question_type),
+            FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ReviewQueue (
+            user_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            question_type TEXT NOT NULL,
+            box INTEGER NOT NULL DEFAULT 0,
+            due_at DATETIME NOT NULL,
+            PRIMARY KEY (user_id, question_id),
+            FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reviewqueue_user_type_due ON ReviewQueue (user_id, question_type, due_at)")
+
+    # Backfill from the saved answers: everything answered is seen, and a question whose
+    # latest answer was wrong is due for review now
+    seen = {}
+    latest = {}
+    rows = cursor.connection.execute(
+        "SELECT a.user_id, q.question_type, a.question_id, a.is_correct "
+        "FROM UserAnswers AS a JOIN temp.QuestionTypes AS q ON q.question_id = a.question_id "
+        "WHERE a.user_id IS NOT NULL ORDER BY a.answer_id"
+    )
+    for user_id, question_type, question_id, is_correct in rows:
+        seen.setdefault((user_id, question_type), SeenSet()).add(question_id)
+        latest[user_id, question_id] = (question_type, is_correct)
+    cursor.executemany(
+        "INSERT OR REPLACE INTO UserSeenQuestions (user_id, question_type, seen) VALUES (?, ?, ?)",
+        ((user_id, question_type, ids.to_bytes()) for (user_id, question_type), ids in seen.items())
+    )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO ReviewQueue (user_id, question_id, question_type, box, due_at) "
+        "VALUES (?, ?, ?, 0, CURRENT_TIMESTAMP)",
+        ((user_id, question_id, question_type)
+         for (user_id, question_id), (question_type, is_correct) in latest.items() if not is_correct)
+    )
+
+
+def _add_answer_archive(cursor):
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(UserAnswers)")}
+    if "answered_at" not in columns:
+        cursor.execute("ALTER TABLE UserAnswers ADD COLUMN answered_at DATETIME")
+    # Older answers have no time of their own: use their exam's start, else the user's
+    # latest attempt, which is never earlier than the answer
+    cursor.execute("""
+        UPDATE UserAnswers SET answered_at = (
+            SELECT started_at FROM ExamSessions AS s WHERE s.session_id = UserAnswers.session_id
+        ) WHERE answered_at IS NULL AND session_id IS NOT NULL
+    """)
+    cursor.execute("""
+        UPDATE UserAnswers SET answered_at = (
+            SELECT IFNULL(last_attempt_at, created_at) FROM Users AS u WHERE u.user_id = UserAnswers.user_id
+        ) WHERE answered_at IS NULL
+    """)
+    cursor.execute("UPDATE UserAnswers SET answered_at = CURRENT_TIMESTAMP WHERE answered_at IS NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_useranswers_answered_at ON UserAnswers (answered_at)")
+    # Totals of the archived answers, per user and question type and per question
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS UserAnswerSummary (
+            user_id INTEGER NOT NULL,
+            question_type TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            correct INTEGER NOT NULL,
+            last_answered_at DATETIME,
+            PRIMARY KEY (user_id, question_type),
+            FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS QuestionAnswerSummary (
+            question_id INTEGER PRIMARY KEY,
+            attempts INTEGER NOT NULL,
+            correct INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS AnswerArchive (
+            file_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            path TEXT NOT NULL,
+            partition_date TEXT NOT NULL,
+            first_answer_id INTEGER NOT NULL,
+            last_answer_id INTEGER NOT NULL,
+            rows INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+# Schema migrations, applied in order at startup. The database's
+# PRAGMA user_version records the last one applied. Each entry is either a
+# list of SQL statements or a function taking a cursor.
+MIGRATIONS = [
+    (1, "Per-user progress totals on Users", _add_user_aggregate_columns),
+    (2, "Indexes for per-user history, answers and question types", [
+        "CREATE INDEX IF NOT EXISTS idx_userprogress_user_completed ON UserProgress (user_id, completed_at)",
+        "CREATE INDEX IF NOT EXISTS idx_useranswers_user_question ON UserAnswers (user_id, question_id, is_correct)",
+        "CREATE INDEX IF NOT EXISTS idx_useranswers_question ON UserAnswers (question_id, is_correct)",
+        "CREATE INDEX IF NOT EXISTS idx_questions_type ON Questions (question_type)",
+    ]),
+    (3, "Normalized question text hash for de-duplicating imports", _add_question_text_hash),
+    (4, "Resumable exam sessions, answers saved as they are submitted", [
+        """CREATE TABLE IF NOT EXISTS ExamSessions (
+            session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            exam_type TEXT NOT NULL,
+            question_ids BLOB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'active',
+            started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_examsessions_user_status ON ExamSessions (user_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_examsessions_status_updated ON ExamSessions (status, updated_at)",
+        "ALTER TABLE UserAnswers ADD COLUMN session_id INTEGER",
+        # Only answers given through a session take part; older rows have no session_id
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_useranswers_session_question "
+        "ON UserAnswers (session_id, question_id) WHERE session_id IS NOT NULL",
+    ]),
+    (5, "Adaptive exam sessions", [
+        "ALTER TABLE ExamSessions ADD COLUMN adaptive INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (6, "Exam type on each attempt and per-type totals for the progress page", _add_exam_history),
+    (7, "Seen questions and spaced-repetition review queue per user", _add_question_history),
+    (8, "Answer timestamps, archived answer totals and the archive file list", _add_answer_archive),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def migrate(conn):
+    # Returns the versions applied; safe to call from several processes at once
+    applied = []
+    for version, _, steps in MIGRATIONS:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have got there first
+            if conn.execute("PRAGMA user_version").fetchone()[0] < version:
+                cursor = conn.cursor()
+                if callable(steps):
+                    steps(cursor)
+                else:
+                    for statement in steps:
+                        cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version = {version}")
+                applied.append(version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return applied
+
+
+@instrument_methods
 class UserDatabase:
-    def __init__(self, db_name="beta.db"):
+    def __init__(self, db_name="beta.db", write_behind=False, bcrypt_rounds=BCRYPT_ROUNDS, bank=None):
         self.db_name = db_name
+        # Where question types are looked up: this file, or for a shard the shared question
+        # bank (a UserDatabase), as a shard's own Questions table is empty
+        self.bank = self if bank is None or bank.db_name == db_name else bank
+        self.hasher = PasswordHasher(bcrypt_rounds)
+        self.pool = get_pool(db_name)
+        self.question_index = get_question_index(db_name)
+        self.cache = get_cache(db_name)
+        self.result_writer = get_result_writer(db_name, self.pool, self._write_exam_results) if write_behind else None
+        self._migrate()
+
+    def _migrate(self):
+        # Bring the schema up to date once per process
+        with _migrate_lock:
+            if self.db_name in _migrated:
+                return
+            conn = self._get_connection()
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                    # Backfills need the types of answered questions
+                    _fill_question_types(conn, self.question_types())
+                migrate(conn)
+            finally:
+                conn.execute("DROP TABLE IF EXISTS temp.QuestionTypes")
+                self._release_connection(conn)
+            _migrated.add(self.db_name)
 
     def _get_connection(self):
-        return sqlite3.connect(self.db_name)
+        return self.pool.acquire()
+
+    def question_type(self, question_id):
+        conn = self.bank._get_connection()
+        try:
+            return self.bank.question_index.question_type(conn, question_id)
+        finally:
+            self.bank._release_connection(conn)
+
+    def question_types(self):
+        # (question_id, question_type) for every question in the bank
+        conn = self.bank._get_connection()
+        try:
+            return self.bank.question_index.types(conn)
+        finally:
+            self.bank._release_connection(conn)
+
+    def _release_connection(self, conn):
+        self.pool.release(conn)
+
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def warm_up(self, connections=None):
+        """Fills the connection pool, loads the question index and starts the hashing workers.
+
+        Meant to run once per server process, in the background, so the
+        first requests don't pay for it.
+        """
+        start = time.perf_counter()
+        opened = self.pool.warm_up(connections)
+        conn = self._get_connection()
+        try:
+            self.question_index.ids(conn, EXAM_TYPES[0])
+        finally:
+            self._release_connection(conn)
+        self.hasher.warm_up()
+        logger.info("Warmed up %s (%d connections) in %.0f ms", self.db_name, opened,
+                    (time.perf_counter() - start) * 1000)
 
     def authenticate_user(self, username, password):
         conn = self._get_connection()
@@ -14,23 +896,37 @@ class UserDatabase:
         try:
             cursor.execute("SELECT password FROM Users WHERE username = ?", (username,))
             user = cursor.fetchone()
-            if user:
-                hashed_password = user[0]
-                if bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8")):
-                    return True
+        finally:
+            self._release_connection(conn)
+
+        # bcrypt runs in the hasher's worker processes, without holding a connection
+        if not user or not self.hasher.check(password, user[0]):
             return False
+        if self.hasher.needs_rehash(user[0]):
+            self._rehash_password(username, password, user[0])
+        return True
+
+    def _rehash_password(self, username, password, old_hash):
+        # Upgrade the stored hash to the configured cost; skipped if it changed meanwhile
+        new_hash = self.hasher.hash(password)
+        conn = self._get_connection()
+        try:
+            conn.execute("UPDATE Users SET password = ? WHERE username = ? AND password = ?",
+                         (new_hash, username, old_hash))
+            conn.commit()
         finally:
-            conn.close()
+            self._release_connection(conn)
 
-    def add_user(self, username, password, email, user_type):
+    def add_user(self, username, password, email, user_type, user_id=None):
+        # user_id is assigned by SQLite unless given (sharded setups allocate ids centrally)
+        hashed_password = self.hasher.hash(password)
         conn = self._get_connection()
         cursor = conn.cursor()
-        hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
         try:
-            cursor.execute("INSERT INTO Users (username, password, email, user_type) VALUES (?, ?, ?, ?)", 
-                           (username, hashed_password, email, user_type))
+            cursor.execute("INSERT INTO Users (user_id, username, password, email, user_type) VALUES (?, ?, ?, ?, ?)", 
+                           (user_id, username, hashed_password, email, user_type))
             conn.commit()
-            print("User created successfully!")
+            logger.info("User %s created successfully!", username)
             return True
         except sqlite3.IntegrityError as e:
             if "username" in str(e):
@@ -40,19 +936,27 @@ class UserDatabase:
             else:
                 raise ValueError("Database error.")
         finally:
-            conn.close()
+            self._release_connection(conn)
+            self._invalidate_user(username)
 
     def is_admin(self, username):
+        # Check if the user_type is 'admin'
+        return self.cache.get_or_load(("role", username), lambda: self._fetch_user_type(username)) == "admin"
+
+    def _fetch_user_type(self, username):
         conn = self._get_connection()
         cursor = conn.cursor()
         try:
             # Query to check the user_type instead of is_admin column
             cursor.execute("SELECT user_type FROM Users WHERE username = ?", (username,))
             result = cursor.fetchone()
-            # Check if the user_type is 'admin'
-            return result[0] == "admin" if result else False
+            return result[0] if result else None
         finally:
-            conn.close()
+            self._release_connection(conn)
+
+    def _invalidate_user(self, username):
+        self.cache.invalidate(("role", username))
+        self.cache.invalidate(("user_id", username))
 
 
     def appoint_admin(self, username):
@@ -65,7 +969,8 @@ class UserDatabase:
             conn.commit()
             return True
         finally:
-            conn.close()
+            self._release_connection(conn)
+            self._invalidate_user(username)
 
     def remove_admin(self, username):
         conn = self._get_connection()
@@ -77,59 +982,172 @@ class UserDatabase:
             conn.commit()
             return True
         finally:
-            conn.close()
+            self._release_connection(conn)
+            self._invalidate_user(username)
 
 
     def get_all_users(self):
         conn = self._get_connection()
         cursor = conn.cursor()
         try:
+            # Totals are maintained on Users by save_exam_results_backend
             cursor.execute("""
                 SELECT 
-                    u.user_id, u.username, u.email, u.user_type, u.user_type, 
-                    IFNULL(SUM(p.questions_attempted), 0) AS total_attempted,
-                    IFNULL(SUM(p.correct_answers), 0) AS total_correct,
-                    IFNULL(SUM(p.score), 0) AS total_score
-                FROM Users u
-                LEFT JOIN UserProgress p ON u.user_id = p.user_id
-                GROUP BY u.user_id;
+                    user_id, username, email, user_type, user_type, 
+                    IFNULL(total_attempted, 0) AS total_attempted,
+                    IFNULL(total_correct, 0) AS total_correct,
+                    IFNULL(total_score, 0) AS total_score
+                FROM Users;
             """)
             users = cursor.fetchall()
             return users
         finally:
-            conn.close()
+            self._release_connection(conn)
 
 
-    def get_random_questions(self, exam_type, num_questions=10):
+    def count_users(self):
+        conn = self._get_connection()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM Users").fetchone()[0]
+        finally:
+            self._release_connection(conn)
+
+    def get_users_page(self, page=0, page_size=50):
+        # Same columns as get_all_users, one page at a time for large user bases
         conn = self._get_connection()
         cursor = conn.cursor()
-        
+        try:
+            cursor.execute("""
+                SELECT 
+                    user_id, username, email, user_type, user_type, 
+                    IFNULL(total_attempted, 0) AS total_attempted,
+                    IFNULL(total_correct, 0) AS total_correct,
+                    IFNULL(total_score, 0) AS total_score
+                FROM Users
+                ORDER BY user_id
+                LIMIT ? OFFSET ?;
+            """, (page_size, page * page_size))
+            return cursor.fetchall()
+        finally:
+            self._release_connection(conn)
+
+    def get_users(self, user_ids):
+        # Same columns as get_all_users, for the given ids
+        conn = self._get_connection()
+        try:
+            placeholders = ", ".join("?" * len(user_ids))
+            return conn.execute(f"""
+                SELECT 
+                    user_id, username, email, user_type, user_type, 
+                    IFNULL(total_attempted, 0) AS total_attempted,
+                    IFNULL(total_correct, 0) AS total_correct,
+                    IFNULL(total_score, 0) AS total_score
+                FROM Users
+                WHERE user_id IN ({placeholders})
+                ORDER BY user_id;
+            """, list(user_ids)).fetchall()
+        finally:
+            self._release_connection(conn)
+
+    def invalidate_questions(self):
+        # Call after questions are imported, edited or deleted
+        self.question_index.refresh()
+        self.cache.invalidate_prefix("question")
+
+    def get_questions(self, question_ids):
+        # Question rows by id, in the order given, served from the shared cache where possible
+        rows = {}
+        missing = []
+        for question_id in question_ids:
+            row = self.cache.get(("question", question_id))
+            if row is None:
+                missing.append(question_id)
+            else:
+                rows[question_id] = row
+
+        if missing:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            try:
+                placeholders = ", ".join("?" * len(missing))
+                cursor.execute(f'''
+                    SELECT question_id, question_text, option_a, option_b, option_c, option_d, correct_answer
+                    FROM Questions
+                    WHERE question_id IN ({placeholders});
+                ''', missing)
+                for row in cursor.fetchall():
+                    # Option texts ("True", "None of the above", ...) repeat across questions; keep one copy
+                    row = tuple(sys.intern(value) if isinstance(value, str) else value for value in row)
+                    rows[row[0]] = row
+                    self.cache.set(("question", row[0]), row)
+            finally:
+                self._release_connection(conn)
+
+        return [rows[question_id] for question_id in question_ids if question_id in rows]
+
+    def sample_question_ids(self, exam_type, num_questions=10, exclude=(), seen=(), review=()):
+        # With a user's history (get_question_history): up to REVIEW_SHARE of the paper is
+        # questions due for review, the rest prefers questions they haven't seen
+        exclude = set(exclude)
+        review = list(dict.fromkeys(question_id for question_id in review if question_id not in exclude))
+        review = review[:int(num_questions * REVIEW_SHARE)]
+        conn = self._get_connection()
+        try:
+            picked = self.question_index.sample(conn, exam_type, num_questions - len(review), exclude, seen,
+                                                reserved=review)
+        finally:
+            self._release_connection(conn)
+        if review:
+            picked += review
+            random.shuffle(picked)
+        return picked
+
+    def get_random_questions(self, exam_type, num_questions=10, exclude=()):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
         # Debug: Log the query parameters
-        print(f"Fetching questions for exam_type: {exam_type}, num_questions: {num_questions}")
-
-        cursor.execute(''' 
-            SELECT question_id, question_text, option_a, option_b, option_c, option_d, correct_answer
-            FROM Questions
-            WHERE question_type = ?
-            ORDER BY RANDOM()
-            LIMIT ?;
-        ''', (exam_type, num_questions))
-        
-        questions = cursor.fetchall()
-        conn.close()
-        
-        print(exam_type)
+        logger.debug("Fetching questions for exam_type: %s, num_questions: %s", exam_type, num_questions)
+
+        try:
+            # Sample ids from the in-memory index, then look up just those rows
+            question_ids = self.question_index.sample(conn, exam_type, num_questions, exclude)
+            questions = self.get_questions(question_ids)
+        finally:
+            self._release_connection(conn)
 
         # Debug: Log the fetched results
-        print(f"Fetched {len(questions)} questions for exam type: {exam_type}")
+        logger.debug("Fetched %d questions for exam type: %s", len(questions), exam_type)
         
         # Fallback: If no questions were found
         if len(questions) == 0:
-            print(f"No questions found for exam type: {exam_type}. Please check your database.")
+            logger.warning("No questions found for exam type: %s. Please check your database.", exam_type)
         
         return questions
 
+    def find_user(self, username, email):
+        # Any existing user with this username or email
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT * FROM Users WHERE username = ? OR email = ?", (username, email))
+            return cursor.fetchone()
+        finally:
+            self._release_connection(conn)
+
+    def get_user_details(self, user_id):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT username, email, user_type FROM Users WHERE user_id = ?", (user_id,))
+            return cursor.fetchone()
+        finally:
+            self._release_connection(conn)
+
     def get_user_id(self, username):
+        return self.cache.get_or_load(("user_id", username), lambda: self._fetch_user_id(username))
+
+    def _fetch_user_id(self, username):
         conn = self._get_connection()
         cursor = conn.cursor()
         try:
@@ -140,50 +1158,321 @@ class UserDatabase:
             else:
                 raise ValueError("User not found.")
         finally:
-            conn.close()
+            self._release_connection(conn)
 
-    def save_exam_results_backend(self, user_id, user_answers):
-        conn = self._get_connection()
-        cursor = conn.cursor()
+    def _write_exam_results(self, cursor, user_id, user_answers):
+        # Runs inside the caller's transaction; the caller commits
         total_attempted = len(user_answers)
         total_correct = sum(1 for _, _, is_correct in user_answers if is_correct)
+        cursor.executemany(
+            "INSERT INTO UserAnswers (user_id, question_id, selected_answer, is_correct, answered_at) "
+            "VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+            [(user_id, question_id, selected_answer, is_correct)
+             for question_id, selected_answer, is_correct in user_answers]
+        )
+        # A paper is drawn from a single question type
+        exam_type = self.question_type(user_answers[0][0]) if user_answers else None
+        self._record_progress(cursor, user_id, total_attempted, total_correct, exam_type)
+        self._record_seen(cursor, user_id, exam_type,
+                          [(question_id, is_correct) for question_id, _, is_correct in user_answers])
+
+    def _record_progress(self, cursor, user_id, total_attempted, total_correct, exam_type=None):
         score = int((total_correct / total_attempted) * 100) if total_attempted > 0 else 0
+        cursor.execute(
+            "INSERT INTO UserProgress (user_id, questions_attempted, correct_answers, score, exam_type) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (user_id, total_attempted, total_correct, score, exam_type)
+        )
+        if exam_type is not None:
+            cursor.execute(
+                "INSERT INTO UserTopicStats (user_id, question_type, questions_attempted, correct_answers, last_attempt_at) "
+                "VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP) "
+                "ON CONFLICT (user_id, question_type) DO UPDATE SET "
+                "questions_attempted = questions_attempted + excluded.questions_attempted, "
+                "correct_answers = correct_answers + excluded.correct_answers, "
+                "last_attempt_at = excluded.last_attempt_at",
+                (user_id, exam_type, total_attempted, total_correct)
+            )
+        # Keep the per-user totals in step with the history
+        cursor.execute(
+            "UPDATE Users SET "
+            "total_attempted = IFNULL(total_attempted, 0) + ?, "
+            "total_correct = IFNULL(total_correct, 0) + ?, "
+            "total_score = IFNULL(total_score, 0) + ?, "
+            "attempt_count = IFNULL(attempt_count, 0) + 1, "
+            "last_attempt_at = CURRENT_TIMESTAMP "
+            "WHERE user_id = ?",
+            (total_attempted, total_correct, score, user_id)
+        )
+
+    def _record_seen(self, cursor, user_id, exam_type, answers):
+        # Adds the answered questions to the user's seen set and moves them through the review queue
+        if exam_type is None or not answers:
+            return
+        cursor.execute("SELECT seen FROM UserSeenQuestions WHERE user_id = ? AND question_type = ?",
+                       (user_id, exam_type))
+        row = cursor.fetchone()
+        seen = SeenSet.from_bytes(row[0] if row else None)
+        if seen.update(question_id for question_id, _ in answers):
+            cursor.execute(
+                "INSERT INTO UserSeenQuestions (user_id, question_type, seen) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id, question_type) DO UPDATE SET seen = excluded.seen",
+                (user_id, exam_type, seen.to_bytes())
+            )
+
+        question_ids = [question_id for question_id, _ in answers]
+        cursor.execute(
+            f"SELECT question_id, box FROM ReviewQueue WHERE user_id = ? "
+            f"AND question_id IN ({', '.join('?' * len(question_ids))})",
+            (user_id, *question_ids)
+        )
+        boxes = dict(cursor.fetchall())
+        for question_id, is_correct in answers:
+            if question_id not in boxes and is_correct:
+                continue
+            review = next_review(boxes.get(question_id, 0), bool(is_correct))
+            if review is None:
+                cursor.execute("DELETE FROM ReviewQueue WHERE user_id = ? AND question_id = ?", (user_id, question_id))
+                continue
+            box, days = review
+            cursor.execute(
+                "INSERT INTO ReviewQueue (user_id, question_id, question_type, box, due_at) "
+                "VALUES (?, ?, ?, ?, datetime('now', ?)) "
+                "ON CONFLICT (user_id, question_id) DO UPDATE SET box = excluded.box, due_at = excluded.due_at",
+                (user_id, question_id, exam_type, box, f"+{days} days")
+            )
+
+    def get_question_history(self, user_id, exam_type, max_reviews=50):
+        """(SeenSet of the questions of exam_type the user has answered, ids due for review, oldest first)."""
+        conn = self._get_connection()
+        try:
+            row = conn.execute("SELECT seen FROM UserSeenQuestions WHERE user_id = ? AND question_type = ?",
+                               (user_id, exam_type)).fetchone()
+            due = conn.execute(
+                "SELECT question_id FROM ReviewQueue WHERE user_id = ? AND question_type = ? "
+                "AND due_at <= CURRENT_TIMESTAMP ORDER BY due_at LIMIT ?",
+                (user_id, exam_type, max_reviews)
+            ).fetchall()
+            return SeenSet.from_bytes(row[0] if row else None), [question_id for (question_id,) in due]
+        finally:
+            self._release_connection(conn)
+
+    def save_exam_results_backend(self, user_id, user_answers):
+        if self.result_writer is not None:
+            # Blocks until the group commit holding this submission is on disk
+            return self.result_writer.submit(user_id, user_answers).result()
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            self._write_exam_results(cursor, user_id, user_answers)
+            conn.commit()
+        finally:
+            self._release_connection(conn)
 
+    def start_exam_session(self, user_id, exam_type, question_ids, adaptive=False):
+        # A student has at most one active session; starting another finishes the old one.
+        # Adaptive sessions choose questions as they go, so only the first one is known here.
+        conn = self._get_connection()
+        cursor = conn.cursor()
         try:
+            cursor.execute("SELECT session_id FROM ExamSessions WHERE user_id = ? AND status = 'active'", (user_id,))
+            for (session_id,) in cursor.fetchall():
+                self._finish_exam_session(cursor, session_id)
             cursor.execute(
-                "INSERT INTO UserProgress (user_id, questions_attempted, correct_answers, score) "
-                "VALUES (?, ?, ?, ?)",
-                (user_id, total_attempted, total_correct, score)
+                "INSERT INTO ExamSessions (user_id, exam_type, question_ids, adaptive) VALUES (?, ?, ?, ?)",
+                (user_id, exam_type, array("q", question_ids).tobytes(), adaptive)
             )
+            conn.commit()
+            return cursor.lastrowid
+        finally:
+            self._release_connection(conn)
 
-            for question_id, selected_answer, is_correct in user_answers:
-                cursor.execute(
-                    "INSERT INTO UserAnswers (user_id, question_id, selected_answer, is_correct) "
-                    "VALUES (?, ?, ?, ?)",
-                    (user_id, question_id, selected_answer, is_correct)
-                )
+    def record_answer(self, session_id, user_id, question_id, selected_answer, is_correct):
+        # One row per answer as it is submitted; answering the same question again overwrites it.
+        # Touching the session first claims the write lock, so it can't be finished or expired in between.
+        conn = self._get_connection()
+        try:
+            touched = conn.execute(
+                "UPDATE ExamSessions SET updated_at = CURRENT_TIMESTAMP WHERE session_id = ? AND status = 'active'",
+                (session_id,)
+            ).rowcount
+            if not touched:
+                conn.rollback()
+                raise ValueError("This exam has already been closed; please start a new exam.")
+            conn.execute(
+                "INSERT INTO UserAnswers (user_id, question_id, selected_answer, is_correct, session_id, answered_at) "
+                "VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP) "
+                "ON CONFLICT (session_id, question_id) WHERE session_id IS NOT NULL "
+                "DO UPDATE SET selected_answer = excluded.selected_answer, is_correct = excluded.is_correct, "
+                "answered_at = excluded.answered_at",
+                (user_id, question_id, selected_answer, is_correct, session_id)
+            )
+            conn.commit()
+        finally:
+            self._release_connection(conn)
+
+    def get_active_exam_session(self, user_id):
+        # (session_id, exam_type, question_ids, answers so far in order, adaptive) for the
+        # student's unfinished exam, if any
+        conn = self._get_connection()
+        try:
+            session = conn.execute(
+                "SELECT session_id, exam_type, question_ids, adaptive FROM ExamSessions "
+                "WHERE user_id = ? AND status = 'active' ORDER BY session_id DESC LIMIT 1",
+                (user_id,)
+            ).fetchone()
+            if not session:
+                return None
+            session_id, exam_type, question_ids, adaptive = session
+            answers = conn.execute(
+                "SELECT question_id, selected_answer, is_correct FROM UserAnswers WHERE session_id = ? "
+                "ORDER BY answer_id",
+                (session_id,)
+            ).fetchall()
+            return session_id, exam_type, array("q", question_ids).tolist(), answers, bool(adaptive)
+        finally:
+            self._release_connection(conn)
 
+    def finish_exam_session(self, session_id):
+        # Records the session's answers as one attempt; returns False if it was already finished
+        conn = self._get_connection()
+        try:
+            finished = self._finish_exam_session(conn.cursor(), session_id)
             conn.commit()
+            return finished
         finally:
-            conn.close()
+            self._release_connection(conn)
+
+    def _finish_exam_session(self, cursor, session_id, status="finished"):
+        # Claiming the row first makes finishing idempotent between the app and the expiry job
+        cursor.execute(
+            "UPDATE ExamSessions SET status = ?, updated_at = CURRENT_TIMESTAMP "
+            "WHERE session_id = ? AND status = 'active' RETURNING user_id, exam_type",
+            (status, session_id)
+        )
+        claimed = cursor.fetchone()
+        if not claimed:
+            return False
+        cursor.execute("SELECT question_id, is_correct FROM UserAnswers WHERE session_id = ?", (session_id,))
+        answers = cursor.fetchall()
+        if answers:
+            self._record_progress(cursor, claimed[0], len(answers), sum(bool(c) for _, c in answers), claimed[1])
+            self._record_seen(cursor, claimed[0], claimed[1], answers)
+        return True
+
+    def expire_exam_sessions(self, max_idle_seconds=3600):
+        # Periodic job: sessions idle for too long are finished with the answers they have,
+        # or marked expired if nothing was answered. Returns (finished, expired).
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT session_id, EXISTS (SELECT 1 FROM UserAnswers WHERE UserAnswers.session_id = s.session_id) "
+                "FROM ExamSessions AS s WHERE status = 'active' AND updated_at < datetime('now', ?)",
+                (f"-{int(max_idle_seconds)} seconds",)
+            )
+            finished = expired = 0
+            for session_id, answered in cursor.fetchall():
+                if self._finish_exam_session(cursor, session_id, "finished" if answered else "expired"):
+                    finished += bool(answered)
+                    expired += not answered
+                conn.commit()
+            return finished, expired
+        finally:
+            self._release_connection(conn)
+
+    def rebuild_user_aggregates(self):
+        # One-off backfill of the Users totals from the full UserProgress history
+        conn = self._get_connection()
+        try:
+            _fill_question_types(conn, self.question_types())
+            cursor = conn.cursor()
+            updated = _rebuild_user_aggregates(cursor)
+            _rebuild_topic_stats(cursor)
+            conn.commit()
+            return updated
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.QuestionTypes")
+            self._release_connection(conn)
+
+    def schema_version(self):
+        conn = self._get_connection()
+        try:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+        finally:
+            self._release_connection(conn)
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    def shards(self):
+        # Databases holding user data (answers, progress); just this one unless sharded
+        return [self]
+
+    def epoch(self):
+        # Bumped when answers are moved between shards; never for a single file
+        return 0
+
+    def result_writer_stats(self):
+        return self.result_writer.stats() if self.result_writer is not None else None
 
     # New method to calculate user progress (Total Attempted, Correct Answers, and Score)
     def get_user_progress(self, user_id):
         conn = self._get_connection()
         cursor = conn.cursor()
         try:
-            cursor.execute("SELECT questions_attempted, correct_answers, score FROM UserProgress WHERE user_id = ?", (user_id,))
-            progress_data = cursor.fetchall()
+            cursor.execute("SELECT total_attempted, total_correct FROM Users WHERE user_id = ?", (user_id,))
+            progress_data = cursor.fetchone()
 
-            if not progress_data:
+            if not progress_data or not progress_data[0]:
                 return 0, 0, 0  # No data found for user
             
-            # Calculate totals
-            total_attempted = sum(data[0] for data in progress_data)
-            total_correct = sum(data[1] for data in progress_data)
+            # Totals are maintained incrementally on the Users row
+            total_attempted, total_correct = progress_data
             total_score = (total_correct/total_attempted)*100
 
             return total_attempted, total_correct, total_score
         finally:
-            conn.close()
+            self._release_connection(conn)
+
+    def get_exam_history(self, user_id, before=None, limit=20, exam_type=None):
+        """A page of attempts, newest first: (progress_id, completed_at, exam_type, attempted, correct, score).
+
+        Pages are keyed rather than offset: pass the last row's
+        (completed_at, progress_id) as `before` to get the next older page,
+        so every page is an index range read whatever the history length.
+        """
+        conditions = ["user_id = ?"]
+        params = [user_id]
+        if exam_type is not None:
+            conditions.append("exam_type = ?")
+            params.append(exam_type)
+        if before is not None:
+            conditions.append("(completed_at, progress_id) < (?, ?)")
+            params.extend(before)
+        conn = self._get_connection()
+        try:
+            return conn.execute(
+                "SELECT progress_id, completed_at, exam_type, questions_attempted, correct_answers, score "
+                f"FROM UserProgress WHERE {' AND '.join(conditions)} "
+                "ORDER BY completed_at DESC, progress_id DESC LIMIT ?",
+                (*params, limit)
+            ).fetchall()
+        finally:
+            self._release_connection(conn)
+
+    def get_topic_stats(self, user_id):
+        # (question_type, attempted, correct, accuracy %) per type, weakest first
+        conn = self._get_connection()
+        try:
+            return conn.execute(
+                "SELECT question_type, questions_attempted, correct_answers, "
+                "100.0 * correct_answers / questions_attempted AS accuracy "
+                "FROM UserTopicStats WHERE user_id = ? AND questions_attempted > 0 "
+                "ORDER BY accuracy, question_type",
+                (user_id,)
+            ).fetchall()
+        finally:
+            self._release_connection(conn)
 